@@ -1,11 +1,20 @@
 from flask import Flask
 import os
+import atexit
 
 def create_app():
     # 初始化Flask应用
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'your-secret-key-here'
     app.config['MONITOR_CONFIG_FILE'] = 'monitor_config.json'
+    # WebSocket定时ping，及时发现已断开的终端连接
+    app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25}
+    # 系统信息采样间隔（秒）
+    app.config['SYSTEM_SAMPLE_INTERVAL'] = float(os.environ.get('SYSTEM_SAMPLE_INTERVAL', 1))
+    # 脚本资源采样间隔（秒）
+    app.config['PROCESS_SAMPLE_INTERVAL'] = float(os.environ.get('PROCESS_SAMPLE_INTERVAL', 2))
+    # 远程主机指标采样间隔（秒）
+    app.config['REMOTE_METRICS_INTERVAL'] = float(os.environ.get('REMOTE_METRICS_INTERVAL', 10))
 
     # 确保必要的目录存在
     if not os.path.exists('script_logs'):
@@ -14,20 +23,72 @@ def create_app():
     # 初始化认证管理器
     from app.utils.auth import AuthManager
     app.auth_manager = AuthManager()
+
+    # 启动系统信息后台采样器，记录指标历史并推送给实时订阅的客户端
+    from app.utils.system_sampler import SystemSampler
+    from app.utils.metrics_history import MetricsHistory
+    from app.utils.metrics_stream import MetricsBroadcaster
+    app.system_sampler = SystemSampler(interval=app.config['SYSTEM_SAMPLE_INTERVAL'])
+    app.metrics_history = MetricsHistory()
+    app.metrics_broadcaster = MetricsBroadcaster()
+    app.system_sampler.subscribe(app.metrics_history.record)
+    app.system_sampler.subscribe(app.metrics_broadcaster.publish)
+    app.system_sampler.start()
+
+    # 配置服务：配置文件只在变化时重新加载
+    from app.utils.config_loader import config_service, load_monitor_config
+    monitor_config = load_monitor_config(app)
+    config_service.start()
+
+    # 脚本索引：后台扫描监控目录并监听变化，脚本列表直接从索引读取
+    from app.utils.script_index import ScriptIndex
+    from app.api.script_api import make_exclude
+    app.script_index = ScriptIndex(monitor_config.get('monitor_paths', ['.']),
+                                   make_exclude(monitor_config.get('exclude_patterns', [])))
+    app.script_index.start()
+    # 监控配置变化时重新编译排除规则并重建索引
+    config_service.subscribe('monitor', lambda config: app.script_index.configure(
+        config.get('monitor_paths', ['.']), make_exclude(config.get('exclude_patterns', []))))
+
+    # 脚本任务的并发数、队列长度和默认资源限制来自监控配置的script_runner项
+    from app.api.script_api import script_supervisor
+    from app.utils.script_runner import runner_settings
+    script_supervisor.configure(**runner_settings(monitor_config))
+    config_service.subscribe('monitor', lambda config: script_supervisor.configure(**runner_settings(config)))
+    # 预热解释器池（可选）：warm_runner.scripts中的脚本由预先导入了常用模块的进程fork运行
+    from app.utils.warm_pool import WarmPool
+    app.warm_pool = WarmPool()
+    app.warm_pool.configure(monitor_config.get('warm_runner'))
+    script_supervisor.warm_pool = app.warm_pool
+    config_service.subscribe('monitor', lambda config: app.warm_pool.configure(config.get('warm_runner')))
+
+    # 脚本资源采样：按脚本记录Python进程和脚本任务的CPU、内存、I/O等
+    from app.utils.resource_sampler import ResourceSampler
+    app.resource_sampler = ResourceSampler(script_supervisor, interval=app.config['PROCESS_SAMPLE_INTERVAL'])
+    app.resource_sampler.start()
     
     # 注册API蓝图
     from app.api.auth_api import auth_bp
-    from app.api.ssh_api import ssh_bp
+    from app.api.ssh_api import ssh_bp, ssh_ws_bp, ssh_manager
     from app.api.script_api import script_bp
     from app.api.config_api import config_bp
     from app.api.system_api import system_bp
 
+    # 远程主机指标：后台并行采集已连接的SSH主机，接口直接返回缓存
+    from app.utils.remote_metrics import RemoteMetricsCollector
+    app.remote_metrics = RemoteMetricsCollector(ssh_manager, interval=app.config['REMOTE_METRICS_INTERVAL'])
+    app.remote_metrics.start()
+
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(ssh_bp, url_prefix='/api/ssh')
+    app.register_blueprint(ssh_ws_bp, url_prefix='/ws')
     app.register_blueprint(script_bp, url_prefix='/api/scripts')
     app.register_blueprint(config_bp, url_prefix='/api/config')
     app.register_blueprint(system_bp, url_prefix='/api/system')
 
+    # 进程退出时停止各后台线程
+    atexit.register(_stop_background_workers, app, ssh_manager)
+
     # 只保留根路径API检查
     @app.route('/api')
     def index():
@@ -35,5 +96,15 @@ def create_app():
     
     return app
 
+def _stop_background_workers(app, ssh_manager):
+    """停止采样器、脚本索引、配置监听和SSH健康检查等后台线程"""
+    from app.utils.config_loader import config_service
+    for worker in (app.system_sampler, app.resource_sampler, app.remote_metrics,
+                   app.script_index, ssh_manager.health_checker, config_service):
+        try:
+            worker.stop()
+        except Exception as e:
+            print(f"停止后台线程失败: {str(e)}")
+
 # 创建应用实例
 app = create_app()
\ No newline at end of file
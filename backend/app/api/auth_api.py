@@ -1,9 +1,25 @@
 from flask import Blueprint, request, jsonify, session, current_app
-from app.utils.auth import AuthManager
+from app.utils.auth import AuthManager, AuthBusyError
+from app.utils.rate_limiter import TokenBucketLimiter
+import math
 import os
 
 auth_bp = Blueprint('auth', __name__)
 
+# 登录限流：每个IP突发20次、每3秒恢复一次；每个用户突发5次、每12秒恢复一次
+ip_limiter = TokenBucketLimiter(capacity=20, rate=1 / 3)
+user_limiter = TokenBucketLimiter(capacity=5, rate=1 / 12)
+
+def _check_rate_limit(username):
+    """检查IP和用户的登录频率，超出时返回429响应"""
+    for limiter, key in ((ip_limiter, request.remote_addr), (user_limiter, username)):
+        allowed, retry_after = limiter.acquire(key)
+        if not allowed:
+            response = jsonify({'success': False, 'error': '尝试次数过多，请稍后再试'})
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response, 429
+    return None
+
 @auth_bp.route('/login', methods=['POST'])
 def api_login():
     """
@@ -16,8 +32,17 @@ def api_login():
     if not username or not password:
         return jsonify({'success': False, 'error': '用户名和密码不能为空'}), 400
 
+    limited = _check_rate_limit(username)
+    if limited is not None:
+        return limited
+
     # Authenticate user
-    if current_app.auth_manager.authenticate(username, password):
+    try:
+        authenticated = current_app.auth_manager.authenticate(username, password)
+    except AuthBusyError:
+        return jsonify({'success': False, 'error': '服务器繁忙，请稍后再试'}), 503
+    if authenticated:
+        user_limiter.reset(username)
         session['username'] = username
         return jsonify({'success': True, 'message': '登录成功'})
     else:
@@ -44,7 +69,10 @@ def change_password():
             return jsonify({'success': False, 'error': '原密码和新密码不能为空'}), 400
 
         username = session['username']
-        
+        limited = _check_rate_limit(username)
+        if limited is not None:
+            return limited
+
         # 验证原密码
         if not current_app.auth_manager.authenticate(username, old_password):
             return jsonify({'success': False, 'error': '原密码错误'}), 400
@@ -55,6 +83,8 @@ def change_password():
             return jsonify({'success': True, 'message': '密码修改成功'})
         else:
             return jsonify({'success': False, 'error': '密码修改失败'}), 500
+    except AuthBusyError:
+        return jsonify({'success': False, 'error': '服务器繁忙，请稍后再试'}), 503
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
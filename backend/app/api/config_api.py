@@ -3,21 +3,18 @@ Configuration API
 Provides endpoints for managing application configuration
 """
 
-import json
-import os
 from flask import Blueprint, request, jsonify
-from app.utils.config_loader import load_monitor_config
+from app.utils.config_loader import load_monitor_config, config_service
 
 config_bp = Blueprint('config', __name__)
 
-MONITOR_CONFIG_FILE = 'monitor_config.json'
-
 @config_bp.route('/monitor', methods=['GET'])
 def get_monitor_config():
     """获取监控配置"""
     try:
-        if os.path.exists(MONITOR_CONFIG_FILE):
-            config = load_monitor_config(None)  # 传递None因为不再需要app参数
+        if config_service.exists('monitor'):
+            # 读取缓存的配置，文件变化时由配置服务重新加载
+            config = load_monitor_config()
             return jsonify(config)
         else:
             # 返回默认配置
@@ -34,8 +31,8 @@ def save_monitor_config():
     """保存监控配置"""
     try:
         config = request.get_json()
-        with open(MONITOR_CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        # 写入后配置服务会通知订阅者（如脚本索引）
+        config_service.save('monitor', config)
         return jsonify({'success': True, 'message': '监控配置已保存'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
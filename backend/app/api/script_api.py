@@ -4,95 +4,119 @@ Provides endpoints for managing Python scripts
 """
 
 import os
+import re
 import sys
-import subprocess
-import glob
-from flask import Blueprint, request, jsonify
+import json
+import math
+import base64
+from flask import Blueprint, request, jsonify, Response, current_app
 from app.utils.config_loader import load_monitor_config
+from app.utils.script_runner import ScriptSupervisor, QueueFullError
+from app.utils.log_search import LogSearcher
+from app.utils.path_matcher import ExcludeMatcher
+from app.utils.script_index import SORT_FIELDS
+from app.utils.process_manager import get_python_processes
 from datetime import datetime
 
 script_bp = Blueprint('script', __name__)
 
+# 脚本任务管理器
+script_supervisor = ScriptSupervisor()
+# 脚本日志搜索
+log_searcher = LogSearcher(script_supervisor.log_dir)
+
 def get_all_python_scripts():
     """
     Get all Python scripts in monitored directories
+    Served from the script index, which is kept current by a file system watcher
     """
-    try:
-        # 加载监控配置
-        config = load_monitor_config(None)
-        monitor_paths = config.get("monitor_paths", ["."])
-        exclude_patterns = config.get("exclude_patterns", [])
-        
-        scripts = []
-        processed_paths = set()  # 避免重复处理相同路径
-        
-        for base_path in monitor_paths:
-            if not os.path.exists(base_path):
-                continue
-                
-            # 规范化路径
-            base_path = os.path.abspath(base_path)
-            
-            # 避免重复处理
-            if base_path in processed_paths:
-                continue
-            processed_paths.add(base_path)
-            
-            # 递归搜索Python文件
-            for root, dirs, files in os.walk(base_path):
-                # 跳过排除的目录
-                dirs[:] = [d for d in dirs if not _should_exclude(os.path.join(root, d), exclude_patterns)]
-                
-                for file in files:
-                    if file.endswith('.py'):
-                        file_path = os.path.join(root, file)
-                        if not _should_exclude(file_path, exclude_patterns):
-                            rel_path = os.path.relpath(file_path, base_path)
-                            last_modified = os.path.getmtime(file_path)
-                            
-                            scripts.append({
-                                'name': file,
-                                'path': file_path,
-                                'relative_path': rel_path,
-                                'last_modified': datetime.fromtimestamp(last_modified).strftime('%Y-%m-%d %H:%M:%S')
-                            })
-        
-        return scripts
-    except Exception as e:
-        print(f"Error getting Python scripts: {e}")
-        return []
+    scripts, _ = current_app.script_index.get_scripts()
+    return scripts
 
-def _should_exclude(path, exclude_patterns):
+def make_exclude(exclude_patterns):
     """
-    Check if a path should be excluded based on patterns
+    Build the exclude check used by the script index
+    Patterns are compiled once, each path is then checked with a single call
     """
-    path = path.replace('\\', '/')  # 统一使用正斜杠
-    
-    for pattern in exclude_patterns:
-        pattern = pattern.replace('\\', '/')  # 统一使用正斜杠
-        if glob.fnmatch.fnmatch(path, pattern):
-            return True
-        # 也检查文件名本身是否匹配模式
-        if glob.fnmatch.fnmatch(os.path.basename(path), pattern):
-            return True
-    return False
+    return ExcludeMatcher(exclude_patterns)
+
+# 脚本列表可返回的字段
+SCRIPT_FIELDS = ('name', 'path', 'relative_path', 'size', 'mtime')
+
+def _encode_cursor(sort, key):
+    return base64.urlsafe_b64encode(json.dumps([sort, key[0], key[1]]).encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor, sort):
+    """解析游标，排序字段不一致或格式错误时抛出ValueError"""
+    try:
+        cursor_sort, value, path = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('无效的游标')
+    if cursor_sort != sort or not isinstance(path, str):
+        raise ValueError('游标与排序方式不一致')
+    # 游标的值与索引中的键比较，类型必须与排序字段一致
+    if sort in ('name', 'path'):
+        valid = isinstance(value, str)
+    else:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+    if not valid:
+        raise ValueError('无效的游标')
+    return (value, path)
 
 @script_bp.route('/list')
 def list_scripts():
     """
-    API endpoint to get all Python scripts
+    API endpoint to list Python scripts, served from the script index
+    Query: limit, cursor, name/path (prefix filters), sort=name|path|mtime|size,
+    order=asc|desc, fields (comma separated projection)
+    `mtime` is returned as epoch seconds, pass `next_cursor` as `cursor` for the next page
     """
     try:
-        # 获取当前目录及子目录中的所有Python脚本
-        scripts = get_all_python_scripts()
-        return jsonify({'success': True, 'scripts': scripts})
+        sort = request.args.get('sort', 'name')
+        if sort not in SORT_FIELDS:
+            return jsonify({'success': False, 'error': f'不支持的排序字段: {sort}'}), 400
+        descending = request.args.get('order', 'asc') == 'desc'
+        limit = min(max(request.args.get('limit', 200, type=int), 1), 5000)
+        fields = [f for f in request.args.get('fields', '').split(',') if f] or list(SCRIPT_FIELDS)
+        unknown = [f for f in fields if f not in SCRIPT_FIELDS]
+        if unknown:
+            return jsonify({'success': False, 'error': f'不支持的字段: {",".join(unknown)}'}), 400
+        cursor = request.args.get('cursor')
+        after = _decode_cursor(cursor, sort) if cursor else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    try:
+        scripts, next_key, total, etag = current_app.script_index.query(
+            sort, descending, after, limit,
+            name_prefix=request.args.get('name'),
+            path_prefix=request.args.get('path')
+        )
+        # 索引内容未变化时返回304
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            if len(fields) != len(SCRIPT_FIELDS):
+                scripts = [{f: script[f] for f in fields} for script in scripts]
+            response = jsonify({
+                'success': True,
+                'scripts': scripts,
+                'next_cursor': _encode_cursor(sort, next_key) if next_key else None,
+                'total': total
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @script_bp.route('/run', methods=['POST'])
 def run_script():
     """
-    Run a Python script
+    Queue a Python script as a background job
+    Returns the job id immediately, output is read via /jobs/<job_id>/output or /stream
+    Optional body fields: priority (higher runs first), cpu_limit (CPU seconds),
+    memory_limit (bytes), dedupe (default true, reuse an identical queued or running job)
     """
     try:
         data = request.get_json()
@@ -104,40 +128,263 @@ def run_script():
         # 验证脚本文件是否存在
         if not os.path.exists(script_path):
             return jsonify({'success': False, 'error': '脚本文件不存在'}), 400
-        
-        # 运行脚本并获取输出
+
         try:
-            # 使用subprocess运行脚本
-            result = subprocess.run(
-                [sys.executable, script_path],
-                capture_output=True,
-                text=True,
-                timeout=30  # 30秒超时
-            )
-            
-            output = result.stdout
-            if result.stderr:
-                output += "\n错误输出:\n" + result.stderr
-                
+            priority = int(data.get('priority', 0))
+            cpu_limit = _positive_number(data.get('cpu_limit'))
+            memory_limit = _positive_number(data.get('memory_limit'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'priority、cpu_limit或memory_limit参数格式错误'}), 400
+
+        try:
+            job, deduplicated = script_supervisor.submit(script_path, priority, cpu_limit, memory_limit,
+                                                         dedupe=data.get('dedupe', True) is not False)
+        except QueueFullError as e:
+            return jsonify({'success': False, 'error': str(e)}), 503
+        if job.status == 'failed':
+            return jsonify({'success': False, 'error': job.error}), 500
+
+        return jsonify({
+            'success': True,
+            'job_id': job.job_id,
+            'deduplicated': deduplicated,
+            'job': _job_dict(job)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _positive_number(value):
+    """解析可选的正数参数，未提供时返回None"""
+    if value is None or value == '':
+        return None
+    value = float(value)
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(value)
+    return value
+
+def _job_dict(job):
+    result = job.to_dict()
+    result['queue_position'] = script_supervisor.queue_position(job)
+    return result
+
+@script_bp.route('/jobs')
+def list_jobs():
+    """
+    List script jobs
+    """
+    try:
+        return jsonify({'success': True, 'jobs': script_supervisor.list_jobs()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@script_bp.route('/processes')
+def list_processes():
+    """
+    List running Python processes
+    """
+    try:
+        return jsonify({'success': True, 'processes': get_python_processes()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@script_bp.route('/processes/stats')
+def get_process_stats():
+    """
+    Per-script resource usage of running Python processes and script jobs
+    Query params: window (seconds of history, default all), running (1 to skip exited scripts)
+    """
+    try:
+        window = request.args.get('window', type=float)
+        if window is not None and window <= 0:
+            return jsonify({'success': False, 'error': 'window参数必须是正数'}), 400
+        running_only = request.args.get('running', '0') in ('1', 'true')
+        sampler = current_app.resource_sampler
+        return jsonify({
+            'success': True,
+            'interval': sampler.interval,
+            'scripts': sampler.get_stats(window, running_only)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@script_bp.route('/warm')
+def get_warm_pool():
+    """
+    Warm interpreter pool status and cold vs warm end-to-end run time per script
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'pool': current_app.warm_pool.status(),
+            'latency': script_supervisor.latency_stats()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@script_bp.route('/jobs/<job_id>')
+def get_job(job_id):
+    """
+    Get status of a script job
+    """
+    try:
+        job = script_supervisor.get_job(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+        return jsonify({'success': True, 'job': _job_dict(job)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@script_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Cancel a queued or running script job
+    """
+    try:
+        job = script_supervisor.cancel(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+        return jsonify({'success': True, 'job': _job_dict(job)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@script_bp.route('/queue')
+def get_queue():
+    """
+    Concurrency limit, running count and queued jobs in run order
+    """
+    try:
+        return jsonify({'success': True, 'queue': script_supervisor.status()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@script_bp.route('/jobs/<job_id>/output')
+def get_job_output(job_id):
+    """
+    Get output lines of a script job starting at line offset `since`
+    Pass the returned `next` as `since` on the following call to resume
+    Use `tail=N` for the last N lines or `from`/`to` for a time range
+    """
+    try:
+        job = script_supervisor.get_job(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+
+        since = max(request.args.get('since', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+
+        # from/to 按时间范围读取（epoch秒或 'YYYY-mm-dd HH:MM:SS'）
+        if 'from' in request.args or 'to' in request.args:
+            start = _parse_log_time(request.args.get('from'), '0000-00-00 00:00:00')
+            end = _parse_log_time(request.args.get('to'), '9999-99-99 99:99:99')
+            rows = job.logger.read_range(start, end, limit)
             return jsonify({
                 'success': True,
-                'output': output,
-                'returncode': result.returncode
+                'lines': [line for _, line in rows],
+                'offsets': [offset for offset, _ in rows],
+                'status': job.status,
+                'returncode': job.returncode
             })
-        except subprocess.TimeoutExpired:
-            return jsonify({
-                'success': False,
-                'error': '脚本执行超时（超过30秒）'
-            }), 400
-        except Exception as e:
-            return jsonify({
-                'success': False,
-                'error': f'执行脚本时出错: {str(e)}'
-            }), 500
-            
+
+        # tail=N 读取最后N行
+        tail = request.args.get('tail', type=int)
+        if tail is not None:
+            lines, next_offset = job.logger.tail(min(max(tail, 0), limit))
+        else:
+            # wait>0时长轮询：没有新输出时最多等待wait秒
+            wait = min(max(request.args.get('wait', 0, type=float), 0), 30)
+            if wait:
+                job.logger.wait_for_logs(since, timeout=wait)
+            lines, next_offset = job.logger.read_logs(since, limit)
+        return jsonify({
+            'success': True,
+            'lines': lines,
+            'next': next_offset,
+            'status': job.status,
+            'finished': job.finished and next_offset >= job.logger.line_count,
+            'returncode': job.returncode
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _parse_log_time(value, default):
+    """解析时间参数：epoch秒或日志中的时间格式"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+@script_bp.route('/jobs/<job_id>/stream')
+def stream_job_output(job_id):
+    """
+    Stream output of a script job via Server-Sent Events
+    Each line is sent with its offset as the event id, so a reconnecting
+    client resumes from Last-Event-ID (or ?since=) without losing lines
+    """
+    job = script_supervisor.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id is not None and last_event_id.isdigit():
+        since = int(last_event_id) + 1
+    else:
+        since = max(request.args.get('since', 0, type=int), 0)
+
+    def generate():
+        offset = since
+        while True:
+            lines, next_offset = job.logger.read_logs(offset, 1000)
+            for i, line in enumerate(lines):
+                yield f"id: {offset + i}\ndata: {json.dumps(line)}\n\n"
+            offset = next_offset
+            if lines:
+                continue
+            if job.finished and offset >= job.logger.line_count:
+                yield f"event: exit\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            if not job.logger.wait_for_logs(offset, timeout=15) and not job.logger.finished:
+                # 保持连接
+                yield ": keepalive\n\n"
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@script_bp.route('/logs/search')
+def search_logs():
+    """
+    Search all script logs, including rotated segments
+    Query: q, regex=1 (default substring), case_sensitive=1, limit, log (log file name filter)
+    Results are streamed as NDJSON, the last line is a summary
+    """
+    try:
+        query = request.args.get('q', '')
+        if not query:
+            return jsonify({'success': False, 'error': '缺少搜索内容'}), 400
+        regex = request.args.get('regex', '0') in ('1', 'true')
+        ignore_case = request.args.get('case_sensitive', '0') not in ('1', 'true')
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 10000)
+        log_filter = request.args.get('log')
+        if regex:
+            re.compile(query)
+    except re.error as e:
+        return jsonify({'success': False, 'error': f'正则表达式错误: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    results = log_searcher.search(query, regex, ignore_case, limit,
+                                  script_supervisor.list_loggers(), log_filter)
+
+    def generate():
+        for result in results:
+            yield json.dumps(result) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @script_bp.route('/content')
 def get_script_content():
     """
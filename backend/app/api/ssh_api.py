@@ -5,19 +5,29 @@ Provides endpoints for managing SSH connections
 
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response
+from flask_sock import Sock
 import paramiko
 import threading
 import json
 import time
+import math
 import os
-from app.utils.ssh_utils import SSHConnectionManager, SSHShellHandler
-from app.utils.config_loader import load_ssh_config, save_ssh_config
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from app.utils.ssh_utils import SSHConnectionManager, SSHShellHandler, SSHShellBridge, CONNECT_TIMEOUT
+from app.utils.config_loader import load_ssh_config, update_ssh_config
 
 ssh_bp = Blueprint('ssh', __name__)
+# WebSocket终端单独使用一个蓝图，挂载在/ws下
+ssh_ws_bp = Blueprint('ssh_ws', __name__)
+sock = Sock()
 
 # 初始化SSH连接管理器
 ssh_manager = SSHConnectionManager()
+# Shell会话注册表，会话在多次请求之间保持
+shell_handler = SSHShellHandler(ssh_manager)
+# 批量执行命令的线程池，限制同时连接的主机数
+fanout_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='ssh-fanout')
 
 @ssh_bp.route('/config', methods=['GET'])
 def get_ssh_config():
@@ -36,26 +46,26 @@ def save_ssh_connection():
         if not connection_data:
             return jsonify({'success': False, 'error': '无效的请求数据'}), 400
 
-        # 加载现有配置
-        config = load_ssh_config()
-        if 'connections' not in config:
-            config['connections'] = []
-
-        # 检查连接名称是否已存在
-        existing_index = None
-        for i, conn in enumerate(config['connections']):
-            if conn['name'] == connection_data['name']:
-                existing_index = i
-                break
-
-        # 更新或添加连接
-        if existing_index is not None:
-            config['connections'][existing_index] = connection_data
-        else:
-            config['connections'].append(connection_data)
-
-        # 保存配置
-        save_ssh_config(config)
+        def apply(config):
+            if 'connections' not in config:
+                config['connections'] = []
+
+            # 检查连接名称是否已存在
+            existing_index = None
+            for i, conn in enumerate(config['connections']):
+                if conn['name'] == connection_data['name']:
+                    existing_index = i
+                    break
+
+            # 更新或添加连接
+            if existing_index is not None:
+                config['connections'][existing_index] = connection_data
+            else:
+                config['connections'].append(connection_data)
+
+        # 在配置锁内读-改-写，并发保存不会互相覆盖
+        if not update_ssh_config(apply):
+            return jsonify({'success': False, 'error': '连接配置写入文件失败'}), 500
         return jsonify({'success': True, 'message': '连接配置保存成功'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -64,16 +74,12 @@ def save_ssh_connection():
 def delete_ssh_connection(conn_name):
     """删除SSH连接配置"""
     try:
-        # 加载现有配置
-        config = load_ssh_config()
-        if 'connections' not in config:
-            config['connections'] = []
+        def apply(config):
+            # 查找并删除连接
+            config['connections'] = [conn for conn in config.get('connections', []) if conn['name'] != conn_name]
 
-        # 查找并删除连接
-        config['connections'] = [conn for conn in config['connections'] if conn['name'] != conn_name]
-
-        # 保存配置
-        save_ssh_config(config)
+        if not update_ssh_config(apply):
+            return jsonify({'success': False, 'error': '连接配置写入文件失败'}), 500
         return jsonify({'success': True, 'message': '连接配置删除成功'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -130,6 +136,67 @@ def get_active_connections():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@ssh_bp.route('/health', methods=['GET'])
+def get_connections_health():
+    """获取SSH连接健康状态（后台检查的缓存结果）"""
+    try:
+        ssh_manager.record_activity()
+        results = ssh_manager.health_checker.get_results()
+        health = []
+        for conn_id in list(ssh_manager.connections):
+            result = results.get(conn_id, {})
+            health.append({
+                'conn_id': conn_id,
+                'connected': ssh_manager.is_connected(conn_id),
+                'last_seen': ssh_manager.last_seen.get(conn_id),
+                'alive': result.get('alive'),
+                'latency': result.get('latency'),
+                'checked_at': result.get('checked_at'),
+                'error': result.get('error')
+            })
+        return jsonify({'success': True, 'connections': health})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@ssh_bp.route('/pool', methods=['GET'])
+def get_pool_stats():
+    """获取SSH连接池统计"""
+    try:
+        return jsonify({'success': True, 'pool': ssh_manager.get_pool_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@ssh_bp.route('/metrics', methods=['GET'])
+def get_remote_metrics():
+    """获取已连接主机的CPU、内存、磁盘和负载（后台采集的缓存结果）"""
+    try:
+        collector = current_app.remote_metrics
+        snapshots = collector.get_snapshots()
+        conn_id = request.args.get('conn_id')
+        if conn_id:
+            if conn_id not in snapshots:
+                return jsonify({'success': False, 'error': '该连接暂无指标数据'}), 404
+            snapshots = {conn_id: snapshots[conn_id]}
+        now = time.time()
+        hosts = []
+        for snapshot in snapshots.values():
+            snapshot = dict(snapshot)
+            snapshot['age'] = max(now - snapshot['collected_at'], 0.0)
+            hosts.append(snapshot)
+        hosts.sort(key=lambda h: h['conn_id'])
+        return jsonify({'success': True, 'interval': collector.interval, 'hosts': hosts})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _parse_timeout(value, default=30):
+    """解析命令超时（秒），未提供时使用默认值，必须为有限正数"""
+    if value is None or value == '':
+        return default
+    timeout = float(value)
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise ValueError(value)
+    return timeout
+
 @ssh_bp.route('/execute', methods=['POST'])
 def execute_ssh_command():
     """在SSH连接上执行命令"""
@@ -137,19 +204,123 @@ def execute_ssh_command():
         data = request.get_json()
         conn_id = data.get('conn_id')
         command = data.get('command')
+        try:
+            timeout = _parse_timeout(data.get('timeout'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'timeout参数格式错误'}), 400
 
         if not conn_id or not command:
             return jsonify({'success': False, 'error': '缺少连接ID或命令'}), 400
 
         # 执行命令
-        output = ssh_manager.execute_command(conn_id, command)
-        return jsonify({'success': True, 'output': output})
+        result = ssh_manager.execute_command(conn_id, command, timeout=timeout)
+        output = result['stdout']
+        if result['stderr']:
+            output += "\n错误输出:\n" + result['stderr']
+        return jsonify({
+            'success': True,
+            'output': output,
+            'exit_status': result['exit_status'],
+            'truncated': result['truncated']
+        })
+    except TimeoutError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _run_on_host(conn_id, connection_data, command, timeout):
+    """在单个主机上执行命令（未连接时先建立连接），返回结果字典"""
+    started = time.monotonic()
+    result = {'type': 'result', 'conn_id': conn_id}
+    try:
+        if not ssh_manager.is_connected(conn_id):
+            if connection_data is None:
+                raise Exception('连接配置不存在')
+            if not ssh_manager.connect(conn_id, connection_data):
+                raise Exception('SSH连接建立失败')
+        output = ssh_manager.execute_command(conn_id, command, timeout=timeout)
+        result.update(success=True, **output)
+    except Exception as e:
+        result.update(success=False, error=str(e))
+    result['latency'] = time.monotonic() - started
+    return result
+
+def _latency_stats(latencies):
+    """计算延迟统计（秒）"""
+    if not latencies:
+        return None
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+    return {
+        'min': latencies[0],
+        'max': latencies[-1],
+        'mean': sum(latencies) / len(latencies),
+        'p50': percentile(0.5),
+        'p95': percentile(0.95)
+    }
+
+@ssh_bp.route('/execute_batch', methods=['POST'])
+def execute_ssh_command_batch():
+    """
+    在多个已保存的连接上并行执行同一命令
+    以NDJSON流式返回，每完成一个主机输出一行结果，最后一行为汇总统计
+    """
+    try:
+        data = request.get_json()
+        command = data.get('command')
+        try:
+            timeout = _parse_timeout(data.get('timeout'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'timeout参数格式错误'}), 400
+        if not command:
+            return jsonify({'success': False, 'error': '缺少命令'}), 400
+
+        # 未指定连接时在所有已保存的连接上执行
+        saved = {conn['name']: conn for conn in load_ssh_config().get('connections', [])}
+        conn_ids = data.get('conn_ids') or list(saved)
+        if not conn_ids:
+            return jsonify({'success': False, 'error': '没有可用的连接'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    started = time.monotonic()
+    futures = [fanout_executor.submit(_run_on_host, conn_id, saved.get(conn_id), command, timeout)
+               for conn_id in dict.fromkeys(conn_ids)]
+
+    def generate():
+        results = []
+        pending = set(futures)
+        try:
+            # 每个主机都有自己的超时，这里再加一个整体上限，防止排队过久
+            for future in as_completed(futures, timeout=timeout + CONNECT_TIMEOUT * 2 + 5):
+                pending.discard(future)
+                result = future.result()
+                results.append(result)
+                yield json.dumps(result) + '\n'
+        except FuturesTimeoutError:
+            pass
+        for future in pending:
+            future.cancel()
+
+        succeeded = [r for r in results if r['success']]
+        yield json.dumps({
+            'type': 'summary',
+            'total': len(futures),
+            'succeeded': len(succeeded),
+            'failed': len(futures) - len(succeeded),
+            'timed_out': len(pending),
+            'elapsed': time.monotonic() - started,
+            'latency': _latency_stats([r['latency'] for r in results])
+        }) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @ssh_bp.route('/shell', methods=['POST'])
 def start_ssh_shell():
-    """启动SSH Shell"""
+    """启动SSH Shell，返回会话ID"""
     try:
         data = request.get_json()
         conn_id = data.get('conn_id')
@@ -158,9 +329,12 @@ def start_ssh_shell():
             return jsonify({'success': False, 'error': '缺少连接ID'}), 400
 
         # 启动Shell
-        shell_handler = SSHShellHandler(ssh_manager.get_client(conn_id))
-        shell_handler.start_shell()
-        return jsonify({'success': True, 'message': 'SSH Shell已启动'})
+        session_id = shell_handler.create_shell(
+            conn_id,
+            cols=int(data.get('cols', 80)),
+            rows=int(data.get('rows', 24))
+        )
+        return jsonify({'success': True, 'message': 'SSH Shell已启动', 'session_id': session_id})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -169,33 +343,71 @@ def send_shell_input():
     """发送Shell输入"""
     try:
         data = request.get_json()
-        conn_id = data.get('conn_id')
+        session_id = data.get('session_id')
         input_data = data.get('input')
 
-        if not conn_id or not input_data:
-            return jsonify({'success': False, 'error': '缺少连接ID或输入数据'}), 400
+        if not session_id or not input_data:
+            return jsonify({'success': False, 'error': '缺少会话ID或输入数据'}), 400
 
         # 发送输入
-        shell_handler = SSHShellHandler(ssh_manager.get_client(conn_id))
-        shell_handler.send_input(input_data)
+        if not shell_handler.send_command(session_id, input_data):
+            return jsonify({'success': False, 'error': 'Shell会话不存在'}), 404
         return jsonify({'success': True, 'message': '输入已发送'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@ssh_bp.route('/shell_resize', methods=['POST'])
+def resize_ssh_shell():
+    """调整Shell终端大小"""
+    try:
+        data = request.get_json()
+        session_id = data.get('session_id')
+        cols = data.get('cols')
+        rows = data.get('rows')
+
+        if not session_id or not cols or not rows:
+            return jsonify({'success': False, 'error': '缺少会话ID或终端大小'}), 400
+
+        if not shell_handler.resize_shell(session_id, int(cols), int(rows)):
+            return jsonify({'success': False, 'error': 'Shell会话不存在'}), 404
+        return jsonify({'success': True, 'message': '终端大小已调整'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @ssh_bp.route('/shell_output', methods=['GET'])
 def get_shell_output():
-    """获取Shell输出"""
+    """
+    获取Shell输出
+    since为上次返回的next，只返回之后的新输出；省略时返回缓冲区中的全部输出
+    """
     try:
-        data = request.get_json()
-        conn_id = data.get('conn_id')
+        session_id = request.args.get('session_id')
+        since = request.args.get('since', type=int)
 
-        if not conn_id:
-            return jsonify({'success': False, 'error': '缺少连接ID'}), 400
+        if not session_id:
+            return jsonify({'success': False, 'error': '缺少会话ID'}), 400
 
         # 获取输出
-        shell_handler = SSHShellHandler(ssh_manager.get_client(conn_id))
-        output = shell_handler.get_output()
-        return jsonify({'success': True, 'output': output})
+        result = shell_handler.read_output(session_id, since)
+        if result is None:
+            return jsonify({'success': False, 'error': 'Shell会话不存在'}), 404
+        output, next_seq, truncated = result
+        session = shell_handler.get_session(session_id)
+        return jsonify({
+            'success': True,
+            'output': output,
+            'next': next_seq,
+            'truncated': truncated,  # 为True时表示部分输出已超出缓冲区被丢弃
+            'closed': session.channel.closed if session else True
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@ssh_bp.route('/shell_sessions', methods=['GET'])
+def list_ssh_shells():
+    """获取所有Shell会话"""
+    try:
+        return jsonify({'success': True, 'sessions': shell_handler.list_shells()})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -204,14 +416,33 @@ def close_ssh_shell():
     """关闭SSH Shell"""
     try:
         data = request.get_json()
-        conn_id = data.get('conn_id')
+        session_id = data.get('session_id')
 
-        if not conn_id:
-            return jsonify({'success': False, 'error': '缺少连接ID'}), 400
+        if not session_id:
+            return jsonify({'success': False, 'error': '缺少会话ID'}), 400
 
         # 关闭Shell
-        shell_handler = SSHShellHandler(ssh_manager.get_client(conn_id))
-        shell_handler.close_shell()
+        if not shell_handler.close_shell(session_id):
+            return jsonify({'success': False, 'error': 'Shell会话不存在'}), 404
         return jsonify({'success': True, 'message': 'SSH Shell已关闭'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@sock.route('/ssh_shell/<conn_id>', bp=ssh_ws_bp)
+def ssh_shell_websocket(ws, conn_id):
+    """WebSocket交互式终端"""
+    ssh_client = ssh_manager.get_client(conn_id)
+    if ssh_client is None:
+        ws.send(json.dumps({'error': 'SSH连接不存在，请先建立连接'}))
+        return
+
+    # 初始终端大小，可通过查询参数指定，之后通过resize消息调整
+    cols = request.args.get('cols', 80, type=int)
+    rows = request.args.get('rows', 24, type=int)
+    bridge = SSHShellBridge(ssh_manager, conn_id, ws, cols=cols, rows=rows)
+    try:
+        bridge.open()
+    except Exception as e:
+        ws.send(json.dumps({'error': f'创建Shell会话失败: {str(e)}'}))
+        return
+    bridge.run()
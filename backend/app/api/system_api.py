@@ -3,72 +3,99 @@ System API
 Provides endpoints for retrieving system information
 """
 
-import psutil
-from flask import Blueprint, jsonify, request
+import math
+import time
+from flask import Blueprint, jsonify, request, current_app, Response
+from app.utils.system_sampler import PROCESS_SORT_KEYS
 
 system_bp = Blueprint('system', __name__)
 
+# 单次请求最多返回的进程数量
+MAX_TOP_PROCESSES = 500
+
 @system_bp.route('/info')
 def get_system_info():
-    """获取系统信息"""
+    """获取系统信息（直接返回后台采样器的最新快照）"""
     try:
-        # CPU信息
-        cpu_percent = psutil.cpu_percent(interval=1)
-        cpu_count = psutil.cpu_count()
-        
-        # 内存信息
-        memory = psutil.virtual_memory()
-        
-        # 磁盘信息 (所有分区)
-        disk_partitions = psutil.disk_partitions()
-        disks = []
-        for partition in disk_partitions:
-            try:
-                usage = psutil.disk_usage(partition.mountpoint)
-                disks.append({
-                    'device': partition.device,
-                    'mountpoint': partition.mountpoint,
-                    'total': usage.total,
-                    'used': usage.used,
-                    'free': usage.free,
-                    'percent': (usage.used / usage.total) * 100 if usage.total > 0 else 0
-                })
-            except PermissionError:
-                # 某些分区可能没有访问权限，跳过
-                continue
-        
-        # 获取CPU和内存占用最高的5个进程
-        processes = []
-        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
-            try:
-                processes.append({
-                    'pid': proc.info['pid'],
-                    'name': proc.info['name'],
-                    'cpu_percent': proc.info['cpu_percent'] or 0,
-                    'memory_percent': proc.info['memory_percent'] or 0
-                })
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                pass
-        
-        # 按CPU使用率排序
-        processes.sort(key=lambda x: x['cpu_percent'], reverse=True)
-        
-        system_info = {
-            'cpu': {
-                'percent': cpu_percent,
-                'count': cpu_count
-            },
-            'memory': {
-                'total': memory.total,
-                'available': memory.available,
-                'used': memory.used,
-                'free': memory.free,
-                'percent': memory.percent
-            },
-            'disks': disks,
-            'top_processes': processes[:5]  # 返回前5个进程
-        }
-        
+        sampler = current_app.system_sampler
+        system_info = sampler.get_snapshot()
+        if system_info is None:
+            return jsonify({'success': False, 'error': '系统信息尚未采集'}), 503
+
+        # 可选参数: n 返回的进程数量, sort 排序方式(cpu/memory)
+        sort = request.args.get('sort', 'cpu')
+        if sort not in PROCESS_SORT_KEYS:
+            return jsonify({'success': False, 'error': 'sort参数只能是cpu或memory'}), 400
+        n = request.args.get('n', 5, type=int)
+        if n is None or n <= 0:
+            return jsonify({'success': False, 'error': 'n参数必须是正整数'}), 400
+        if n != 5 or sort != 'cpu':
+            system_info['top_processes'] = sampler.get_top_processes(min(n, MAX_TOP_PROCESSES), sort)
+
         return jsonify({'success': True, 'system_info': system_info})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@system_bp.route('/stream')
+def stream_system_info():
+    """通过Server-Sent Events推送系统信息，首帧为完整快照，之后只推送变化的字段"""
+    broadcaster = current_app.metrics_broadcaster
+    return Response(
+        broadcaster.stream(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 禁止nginx等反向代理缓冲
+        }
+    )
+
+# 时间范围单位
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def _parse_duration(value, default):
+    """解析时间长度参数，支持纯秒数或带单位的写法，如 30m、6h、7d；不是有限正数时抛出ValueError"""
+    if not value:
+        return default
+    value = value.strip().lower()
+    if value and value[-1] in _DURATION_UNITS:
+        seconds = float(value[:-1]) * _DURATION_UNITS[value[-1]]
+    else:
+        seconds = float(value)
+    # float()接受nan、inf和负数，这些都不是有效的时间长度
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError(value)
+    return seconds
+
+@system_bp.route('/history')
+def get_system_history():
+    """获取系统指标历史（列式JSON）"""
+    try:
+        history = current_app.metrics_history
+        metrics = [m for m in request.args.get('metric', 'cpu').split(',') if m]
+        unknown = [m for m in metrics if m not in history.metrics]
+        if not metrics or unknown:
+            return jsonify({
+                'success': False,
+                'error': f"不支持的指标: {','.join(unknown)}，可选: {','.join(history.metrics)}"
+            }), 400
+
+        try:
+            time_range = _parse_duration(request.args.get('range'), 3600)
+            step = _parse_duration(request.args.get('step'), 0)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'range或step参数格式错误'}), 400
+        if time_range <= 0 or step < 0:
+            return jsonify({'success': False, 'error': 'range或step参数格式错误'}), 400
+
+        until = time.time()
+        since = until - time_range
+        step, timestamps, columns = history.query(metrics, since, until, step)
+
+        return jsonify({
+            'success': True,
+            'step': step,
+            'timestamps': [round(t, 3) for t in timestamps],
+            'metrics': {name: [round(v, 2) for v in values] for name, values in columns.items()}
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
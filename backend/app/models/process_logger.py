@@ -4,29 +4,267 @@ Provides functionality for capturing and storing process logs
 """
 
 import os
+import time
+import bisect
 import threading
+import weakref
 from collections import deque
 from datetime import datetime
+from itertools import islice
+from app.utils.log_segments import LogSegment, compress_segment, remove_segment_files
+
+# Flush buffered lines once this many bytes are pending
+FLUSH_SIZE = 64 * 1024
+# Flush buffered lines at least this often (seconds)
+FLUSH_INTERVAL = 0.5
+# Rotate the log file once it reaches this size (bytes)
+ROTATE_SIZE = 16 * 1024 * 1024
+# Rotate the log file once its first line is this old (seconds)
+ROTATE_INTERVAL = 3600
+# Rotated (compressed) segments kept per log, older ones are deleted
+MAX_SEGMENTS = 20
+
+_timestamp_cache = (None, '')
+
+
+def _timestamp_key(value):
+    """Convert epoch seconds to the sortable timestamp format used in log lines"""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def _format_timestamp():
+    """Format the current time, reusing the string within the same second"""
+    global _timestamp_cache
+    second = int(time.time())
+    cached_second, text = _timestamp_cache
+    if cached_second != second:
+        text = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+        _timestamp_cache = (second, text)
+    return text
+
+
+class _LogWriter:
+    """Background thread that flushes the buffered lines of all open loggers"""
+
+    def __init__(self):
+        self.loggers = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, logger):
+        with self.lock:
+            self.loggers.add(logger)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='process-log-writer')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unregister(self, logger):
+        with self.lock:
+            self.loggers.discard(logger)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            with self.lock:
+                loggers = list(self.loggers)
+            for logger in loggers:
+                try:
+                    logger.flush()
+                except Exception as e:
+                    print(f"Error writing to log file: {e}")
+
+
+_log_writer = _LogWriter()
 
 
 class ProcessLogger:
     """Helper class to capture and store process logs"""
-    
+
     def __init__(self, pid, log_file_path):
         self.pid = pid
         self.log_file_path = log_file_path
         self.log_queue = deque(maxlen=1000)  # Keep last 1000 lines in memory
+        self.line_count = 0  # Total lines logged, used as the read offset
+        self.finished = False
         self.lock = threading.Lock()
-        
-    def append_log(self, line):
-        with self.lock:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.condition = threading.Condition(self.lock)
+        self._pending = []       # Lines waiting to be written to the file
+        self._pending_bytes = 0
+        self._file = None
+        self._write_lock = threading.Lock()  # Serializes file writes and segment changes, taken before self.lock
+        self.segments = []  # Rotated segments, oldest first
+        self.active = self._new_segment(0)  # Segment currently written to log_file_path
+        self._rotations = 0
+        _log_writer.register(self)
+
+    def _new_segment(self, first_line):
+        segment = LogSegment(self.log_file_path, first_line)
+        segment.created_at = time.time()
+        return segment
+
+    def append_log(self, line, stream='stdout'):
+        timestamp = _format_timestamp()
+        if stream == 'stderr':
+            log_entry = f"[{timestamp}] [stderr] {line}"
+        else:
             log_entry = f"[{timestamp}] {line}"
+
+        with self.lock:
             self.log_queue.append(log_entry)
-            
-            # Also write to file
+            self.line_count += 1
+            # Written to the file in batches by the writer thread
+            self._pending.append(log_entry)
+            self._pending_bytes += len(log_entry) + 1
+            if self._pending_bytes >= FLUSH_SIZE:
+                _log_writer.wakeup.set()
+            self.condition.notify_all()
+
+    def flush(self):
+        """Write all buffered lines to the log file"""
+        with self._write_lock:
+            with self.lock:
+                if not self._pending:
+                    return
+                pending = self._pending
+                self._pending = []
+                self._pending_bytes = 0
             try:
-                with open(self.log_file_path, 'a', encoding='utf-8') as f:
-                    f.write(log_entry + '\n')
+                if self.active.lines and time.time() - self.active.created_at >= ROTATE_INTERVAL:
+                    self._rotate()
+                if self._file is None:
+                    self._file = open(self.log_file_path, 'ab')
+                entries = [(line, (line + '\n').encode('utf-8')) for line in pending]
+                self._file.write(self.active.add_lines(entries))
+                self._file.flush()
+                if self.active.size >= ROTATE_SIZE:
+                    self._rotate()
             except Exception as e:
-                print(f"Error writing to log file: {e}")
\ No newline at end of file
+                print(f"Error writing to log file: {e}")
+
+    def _rotate(self):
+        """Move the active file to a numbered segment and compress it in the background (holds _write_lock)"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._rotations += 1
+        segment = self.active
+        segment.path = f"{self.log_file_path}.{self._rotations}"
+        os.replace(self.log_file_path, segment.path)
+        segment.save_index()
+        self.segments.append(segment)
+        self.active = self._new_segment(segment.end_line)
+
+        while len(self.segments) > MAX_SEGMENTS:
+            remove_segment_files(self.segments.pop(0))
+
+        compressor = threading.Thread(target=self._compress, args=(segment,), name='process-log-compress')
+        compressor.daemon = True
+        compressor.start()
+
+    def _compress(self, segment):
+        """Replace a rotated segment with its gzip compressed copy"""
+        try:
+            compressed = compress_segment(segment)
+        except Exception as e:
+            print(f"Error compressing log segment: {e}")
+            return
+        with self._write_lock:
+            if segment in self.segments:
+                self.segments[self.segments.index(segment)] = compressed
+                obsolete = segment
+            else:
+                # Deleted by retention while compressing
+                obsolete = compressed
+        remove_segment_files(obsolete)
+
+    def close(self):
+        """Flush buffered lines, close the log file and write its index"""
+        self.flush()
+        _log_writer.unregister(self)
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self.active.lines:
+                try:
+                    self.active.build_filter()
+                    self.active.save_index()
+                except Exception as e:
+                    print(f"Error writing log index: {e}")
+
+    def finish(self):
+        """Mark the process as finished, close the log file and wake up waiting readers"""
+        self.close()
+        with self.lock:
+            self.finished = True
+            self.condition.notify_all()
+
+    def read_logs(self, since=0, limit=1000):
+        """
+        Return (lines, next_offset) for lines starting at offset `since`.
+        Recent lines come from memory, older ones are read from the indexed log segments.
+        """
+        with self.lock:
+            line_count = self.line_count
+            first_in_memory = line_count - len(self.log_queue)
+            since = max(0, min(since, line_count))
+            if since >= first_in_memory:
+                start = since - first_in_memory
+                lines = list(islice(self.log_queue, start, start + limit))
+                return lines, since + len(lines)
+
+        # Older lines are only on disk, make sure everything up to line_count is written
+        self.flush()
+        with self._write_lock:
+            segments = self.segments + [self.active]
+            # Lines of deleted segments are gone, continue from the oldest one kept
+            since = max(since, segments[0].first_line)
+            lines = []
+            i = max(bisect.bisect_right([s.first_line for s in segments], since) - 1, 0)
+            for segment in segments[i:]:
+                if len(lines) >= limit:
+                    break
+                lines.extend(segment.read_lines(since + len(lines), limit - len(lines)))
+        return lines, since + len(lines)
+
+    def snapshot_segments(self):
+        """Flush buffered lines and return the current segments, oldest first"""
+        self.flush()
+        with self._write_lock:
+            return [s for s in self.segments + [self.active] if s.lines]
+
+    def tail(self, n):
+        """Return (lines, next_offset) for the last `n` lines"""
+        with self.lock:
+            line_count = self.line_count
+        return self.read_logs(max(line_count - n, 0), n)
+
+    def read_range(self, start, end, limit=1000):
+        """
+        Return [(offset, line)] for lines logged between `start` and `end`
+        (inclusive, 'YYYY-mm-dd HH:MM:SS' strings or epoch seconds)
+        """
+        start, end = _timestamp_key(start), _timestamp_key(end)
+        self.flush()
+        result = []
+        with self._write_lock:
+            segments = [s for s in self.segments + [self.active] if s.lines]
+            # Segments are in time order, skip those that ended before `start`
+            i = bisect.bisect_left([s.last_ts for s in segments], start)
+            for segment in segments[i:]:
+                if len(result) >= limit or segment.first_ts > end:
+                    break
+                result.extend(segment.read_between(start, end, limit - len(result)))
+        return result
+
+    def wait_for_logs(self, since, timeout=None):
+        """Block until there are lines after `since` or the process finished"""
+        with self.lock:
+            if self.line_count <= since and not self.finished:
+                self.condition.wait(timeout)
+            return self.line_count > since
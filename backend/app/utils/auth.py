@@ -1,6 +1,83 @@
-import hashlib
-import json
 import os
+import hmac
+import time
+import base64
+import binascii
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.config_loader import config_service
+
+# scrypt cost parameters, tunable through the environment
+SCRYPT_N = int(os.environ.get('AUTH_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('AUTH_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('AUTH_SCRYPT_P', 1))
+# PBKDF2 iterations, used when hashlib has no scrypt
+PBKDF2_ITERATIONS = int(os.environ.get('AUTH_PBKDF2_ITERATIONS', 600000))
+SALT_BYTES = 16
+# Threads doing hash work, and how many requests may wait for them
+HASH_WORKERS = int(os.environ.get('AUTH_HASH_WORKERS', 2))
+HASH_QUEUE = 8
+# Successful verifications remembered so repeated checks skip the slow hash
+VERIFY_CACHE_SIZE = 1000
+VERIFY_CACHE_TTL = 300
+
+
+class AuthBusyError(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password):
+    """Salted slow hash, stored as '<algorithm>$<params>$<salt>$<hash>'"""
+    salt = secrets.token_bytes(SALT_BYTES)
+    if hasattr(hashlib, 'scrypt'):
+        digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                                maxmem=128 * SCRYPT_N * SCRYPT_R * 2)
+        return f'scrypt${SCRYPT_N},{SCRYPT_R},{SCRYPT_P}${_b64(salt)}${_b64(digest)}'
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+    return f'pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}'
+
+
+def verify_password(password, stored):
+    """Check a password against a stored hash, legacy unsalted SHA-256 hex included
+    A malformed stored hash never matches"""
+    try:
+        return _verify_password(password.encode('utf-8'), stored)
+    except (ValueError, OverflowError, binascii.Error):
+        # Bad parameter fields, bad base64, or parameters scrypt/pbkdf2 reject
+        return False
+
+
+def _verify_password(password, stored):
+    parts = stored.split('$')
+    if len(parts) == 4 and parts[0] == 'scrypt':
+        n, r, p = (int(x) for x in parts[1].split(','))
+        expected = base64.b64decode(parts[3], validate=True)
+        digest = hashlib.scrypt(password, salt=base64.b64decode(parts[2], validate=True), n=n, r=r, p=p,
+                                maxmem=128 * n * r * 2, dklen=len(expected))
+    elif len(parts) == 4 and parts[0] == 'pbkdf2_sha256':
+        expected = base64.b64decode(parts[3], validate=True)
+        digest = hashlib.pbkdf2_hmac('sha256', password, base64.b64decode(parts[2], validate=True),
+                                     int(parts[1]), dklen=len(expected))
+    else:
+        # Legacy format
+        expected = stored.encode('ascii', errors='replace')
+        digest = hashlib.sha256(password).hexdigest().encode('ascii')
+    return hmac.compare_digest(digest, expected)
+
+
+def needs_rehash(stored):
+    """True for legacy hashes and hashes made with weaker parameters than the current ones"""
+    parts = stored.split('$')
+    if hasattr(hashlib, 'scrypt'):
+        return len(parts) != 4 or parts[0] != 'scrypt' or parts[1] != f'{SCRYPT_N},{SCRYPT_R},{SCRYPT_P}'
+    return len(parts) != 4 or parts[0] != 'pbkdf2_sha256' or int(parts[1]) < PBKDF2_ITERATIONS
 
 
 class AuthManager:
@@ -8,13 +85,24 @@ class AuthManager:
         self.auth_config_file = config_file
         self.default_username = 'admin'
         self.default_password = '123456'
+        self.lock = threading.Lock()
+        # Hashing is CPU heavy, keep it on a small pool so a login flood can't take every core
+        self.hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='auth-hash')
+        self._hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+        self._cache_key = secrets.token_bytes(32)
+        self._verified = OrderedDict()   # (username, stored hash) -> (keyed password digest, time)
+        self._cache_lock = threading.Lock()
+        # Hash compared against when the user is unknown, made once up front on the bounded pool
+        self._dummy = self._hash_password(secrets.token_hex(8))
         self.load_or_create_config()
 
     def load_or_create_config(self):
         """Load existing auth config or create default one"""
-        if os.path.exists(self.auth_config_file):
-            with open(self.auth_config_file, 'r') as f:
-                self.auth_config = json.load(f)
+        # The shared config store caches the file and reloads it when it changes on disk
+        config_service.register('auth', self.auth_config_file, {'users': {}})
+        config_service.subscribe('auth', self._on_reload)
+        if config_service.exists('auth'):
+            self.auth_config = config_service.get('auth')
         else:
             # Create default config
             self.auth_config = {
@@ -24,55 +112,107 @@ class AuthManager:
             }
             self._save_config()
 
+    def _on_reload(self, config):
+        self.auth_config = config
+
     def _save_config(self):
-        """Save auth config to file"""
-        with open(self.auth_config_file, 'w') as f:
-            json.dump(self.auth_config, f, indent=2)
+        """Save auth config to file (atomic write through the config store)"""
+        config_service.save('auth', self.auth_config)
+
+    def _run_hash(self, func, *args):
+        """Run hash work on the bounded pool, raise AuthBusyError when it is saturated"""
+        if not self._hash_slots.acquire(timeout=1):
+            raise AuthBusyError('Too many concurrent password checks')
+        try:
+            return self.hash_pool.submit(func, *args).result()
+        finally:
+            self._hash_slots.release()
 
     def _hash_password(self, password):
-        """Hash password using SHA256"""
-        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+        """Hash password with a random salt"""
+        return self._run_hash(hash_password, password)
+
+    def _password_digest(self, password):
+        return hmac.new(self._cache_key, password.encode('utf-8'), hashlib.sha256).digest()
+
+    def _check_cache(self, key, password):
+        with self._cache_lock:
+            entry = self._verified.get(key)
+        if entry is None or time.monotonic() - entry[1] > VERIFY_CACHE_TTL:
+            return False
+        return hmac.compare_digest(entry[0], self._password_digest(password))
+
+    def _remember(self, key, password):
+        with self._cache_lock:
+            self._verified[key] = (self._password_digest(password), time.monotonic())
+            self._verified.move_to_end(key)
+            while len(self._verified) > VERIFY_CACHE_SIZE:
+                self._verified.popitem(last=False)
 
     def authenticate(self, username, password):
-        """Authenticate user"""
-        if 'users' not in self.auth_config:
+        """Authenticate user, upgrading legacy or weaker hashes on success"""
+        users = self.auth_config.get('users', {})
+        stored = users.get(username)
+        if stored is None:
+            # Hash anyway so unknown users take as long as wrong passwords
+            self._run_hash(verify_password, password, self._dummy)
             return False
 
-        hashed_password = self._hash_password(password)
-        return (username in self.auth_config['users'] and
-                self.auth_config['users'][username] == hashed_password)
+        key = (username, stored)
+        if self._check_cache(key, password):
+            return True
+        if not self._run_hash(verify_password, password, stored):
+            return False
+        self._remember(key, password)
+
+        if needs_rehash(stored):
+            upgraded = self._hash_password(password)
+            with self.lock:
+                if self.auth_config.get('users', {}).get(username) == stored:
+                    self.auth_config['users'][username] = upgraded
+                    self._save_config()
+                    self._remember((username, upgraded), password)
+        return True
 
     def change_password(self, username, new_password):
         """Update user password"""
-        if 'users' not in self.auth_config:
-            self.auth_config['users'] = {}
+        hashed_password = self._hash_password(new_password)
+        with self.lock:
+            if 'users' not in self.auth_config:
+                self.auth_config['users'] = {}
 
-        self.auth_config['users'][username] = self._hash_password(new_password)
-        self._save_config()
+            self.auth_config['users'][username] = hashed_password
+            self._save_config()
         return True
 
     def add_user(self, username, password):
         """Add new user"""
-        if 'users' not in self.auth_config:
-            self.auth_config['users'] = {}
-
-        if username in self.auth_config['users']:
+        if username in self.auth_config.get('users', {}):
             return False
 
-        self.auth_config['users'][username] = self._hash_password(password)
-        self._save_config()
+        hashed_password = self._hash_password(password)
+        with self.lock:
+            if 'users' not in self.auth_config:
+                self.auth_config['users'] = {}
+
+            if username in self.auth_config['users']:
+                return False
+
+            self.auth_config['users'][username] = hashed_password
+            self._save_config()
         return True
 
     def delete_user(self, username):
         """Delete user"""
-        if 'users' not in self.auth_config:
-            return False
+        with self.lock:
+            if 'users' not in self.auth_config:
+                return False
 
-        if username not in self.auth_config['users']:
-            return False
+            if username not in self.auth_config['users']:
+                return False
 
-        del self.auth_config['users'][username]
-        self._save_config()
+            del self.auth_config['users'][username]
+            self._save_config()
         return True
 
     def get_users(self):
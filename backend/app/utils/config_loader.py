@@ -4,51 +4,311 @@ Provides functionality for loading and managing configuration files
 """
 
 import os
+import copy
 import json
+import time
+import shutil
 import logging
+import tempfile
+import threading
 
 logger = logging.getLogger(__name__)
 
+# 监控配置文件路径
+MONITOR_CONFIG_FILE = 'monitor_config.json'
 # SSH配置文件路径
 SSH_CONFIG_FILE = 'ssh_config.json'
+# 后台检查配置文件变化的间隔（秒）
+CONFIG_POLL_INTERVAL = 1.0
+# 写入前等待的时间，期间的多次保存合并为一次写入（秒）
+WRITE_COALESCE_DELAY = 0.05
 
-def load_monitor_config(app):
-    """Load monitor configuration from file"""
+DEFAULT_MONITOR_CONFIG = {
+    "monitor_paths": ["."],
+    "exclude_patterns": ["monitor.py"]
+}
+DEFAULT_SSH_CONFIG = {
+    "connections": []
+}
+
+
+def atomic_write_json(path, data):
+    """先写临时文件并fsync，再rename替换，任何时刻文件都是完整的"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # 保留原文件的权限
+            shutil.copymode(path, tmp_path)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 确保rename本身也已落盘
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+class ConfigFile:
+    """一个缓存的JSON配置文件"""
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+        self.data = copy.deepcopy(default)
+        self.signature = None     # (st_ino, st_mtime_ns, st_size)，文件不存在时为None
+        self.exists = False
+        self.listeners = []
+        self.version = 0          # 内存中配置的版本，每次保存加一
+        self.written = 0          # 已处理（写入或写入失败）的版本
+        self.saved = 0            # 最近一次成功写入文件的版本
+        self.writing = False
+        self.write_condition = threading.Condition()  # 每个文件一把写锁
+
+    def stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class ConfigService:
+    """
+    配置服务：配置文件只在inode/mtime变化时重新解析，
+    请求直接读取内存中的配置，重新加载后通知订阅者
+    """
+
+    def __init__(self, poll_interval=CONFIG_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.files = {}   # 名称 -> ConfigFile
+        self.lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def register(self, name, path, default):
+        """注册配置文件并立即加载，路径不变时重复注册无副作用"""
+        with self.lock:
+            entry = self.files.get(name)
+            if entry is not None and entry.path == path:
+                return
+            new_entry = ConfigFile(path, default)
+            if entry is not None:
+                new_entry.listeners = entry.listeners
+            self.files[name] = new_entry
+        self.reload(name)
+
+    def start(self):
+        """启动后台线程检查配置文件变化（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='config-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def subscribe(self, name, callback):
+        """订阅配置重新加载，callback(config)"""
+        with self.lock:
+            self.files[name].listeners.append(callback)
+
+    def get(self, name):
+        """返回配置的副本，不访问磁盘"""
+        with self.lock:
+            return copy.deepcopy(self.files[name].data)
+
+    def exists(self, name):
+        """配置文件在最近一次检查时是否存在"""
+        with self.lock:
+            return self.files[name].exists
+
+    def reload(self, name, force=False):
+        """文件变化（或force）时重新解析并通知订阅者，返回是否重新加载"""
+        with self.lock:
+            entry = self.files[name]
+            signature = entry.stat_signature()
+            if not force and signature == entry.signature and entry.signature is not None:
+                return False
+            if entry.writing or entry.written < entry.version:
+                # 有尚未写完的保存，内存中的配置才是最新的
+                return False
+            if signature is None:
+                data = copy.deepcopy(entry.default)
+            else:
+                try:
+                    with open(entry.path, 'r') as f:
+                        data = json.load(f)
+                except Exception as e:
+                    # 解析失败（如正在写入）时保留上次的配置，下次检查再试
+                    logger.error(f"Error loading config {entry.path}: {e}")
+                    return False
+            changed = data != entry.data
+            entry.data = data
+            entry.signature = signature
+            entry.exists = signature is not None
+            listeners = list(entry.listeners)
+            snapshot = copy.deepcopy(data)
+        if changed:
+            for callback in listeners:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    logger.error(f"Error in config subscriber for {name}: {e}")
+        return True
+
+    def save(self, name, config):
+        """保存配置：立即更新缓存，返回前已写入文件"""
+        self.update(name, lambda data: config)
+
+    def update(self, name, mutate):
+        """
+        在锁内对当前配置的副本做读-改-写，mutate(data)可原地修改或返回新配置
+        并发的多次更新不会互相覆盖，短时间内的连续更新合并为一次写入
+        """
+        with self.lock:
+            entry = self.files[name]
+            data = copy.deepcopy(entry.data)
+            result = mutate(data)
+            if result is not None:
+                data = result
+            changed = data != entry.data
+            entry.data = data
+            entry.version += 1
+            version = entry.version
+            listeners = list(entry.listeners)
+            snapshot = copy.deepcopy(data)
+        if changed:
+            for callback in listeners:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    logger.error(f"Error in config subscriber for {name}: {e}")
+        try:
+            self._flush(entry, version)
+        except Exception:
+            # 写入失败：丢弃未保存的修改，重新以文件内容为准
+            self.reload(name, force=True)
+            raise
+
+    def _flush(self, entry, version):
+        """等待version写入文件；没有正在进行的写入时由当前线程负责写入最新版本"""
+        with entry.write_condition:
+            while entry.written < version:
+                if entry.writing:
+                    entry.write_condition.wait()
+                    continue
+                entry.writing = True
+                break
+            else:
+                if entry.saved < version:
+                    # 合并进的那次写入失败了
+                    raise OSError(f"Failed to write config {entry.path}")
+                return
+
+        written = None
+        target = None
+        try:
+            # 稍等片刻，让紧接着的保存合并进这次写入
+            time.sleep(WRITE_COALESCE_DELAY)
+            with self.lock:
+                data = copy.deepcopy(entry.data)
+                target = entry.version
+            atomic_write_json(entry.path, data)
+            signature = entry.stat_signature()
+            with self.lock:
+                # 记录自己写入后的文件签名，后台检查时不再重复解析
+                entry.signature = signature
+                entry.exists = True
+            written = target
+        finally:
+            with entry.write_condition:
+                entry.writing = False
+                if written is None and target is not None:
+                    # 写入失败时也推进已处理的版本，否则之后的reload会一直忽略磁盘上的文件
+                    written = target
+                    with self.lock:
+                        entry.signature = None
+                elif written is not None:
+                    entry.saved = max(entry.saved, written)
+                if written is not None:
+                    entry.written = max(entry.written, written)
+                entry.write_condition.notify_all()
+
+    def check_all(self):
+        with self.lock:
+            names = list(self.files)
+        for name in names:
+            self.reload(name)
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Error checking config files: {e}")
+
+
+# 全局配置服务
+config_service = ConfigService()
+config_service.register('monitor', MONITOR_CONFIG_FILE, DEFAULT_MONITOR_CONFIG)
+config_service.register('ssh', SSH_CONFIG_FILE, DEFAULT_SSH_CONFIG)
+
+
+def load_monitor_config(app=None):
+    """Load monitor configuration (cached, reloaded when the file changes)"""
+    if app is not None:
+        config_service.register('monitor', app.config.get('MONITOR_CONFIG_FILE', MONITOR_CONFIG_FILE),
+                                DEFAULT_MONITOR_CONFIG)
+    return config_service.get('monitor')
+
+def save_monitor_config(config):
+    """Save monitor configuration to file"""
     try:
-        with open(app.config['MONITOR_CONFIG_FILE'], 'r') as f:
-            return json.load(f)
+        config_service.save('monitor', config)
+        return True
     except Exception as e:
-        logger.error(f"Error loading monitor config: {e}")
-        # Return default config
-        return {
-            "monitor_paths": ["."],
-            "exclude_patterns": ["monitor.py"]
-        }
+        logger.error(f"Error saving monitor config: {e}")
+        return False
 
 def load_ssh_config():
-    """Load SSH configuration from file"""
+    """Load SSH configuration (cached, reloaded when the file changes)"""
+    return config_service.get('ssh')
+
+def update_ssh_config(mutate):
+    """Read-modify-write the SSH configuration under the config lock"""
     try:
-        if os.path.exists(SSH_CONFIG_FILE):
-            with open(SSH_CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        else:
-            # Return default config
-            return {
-                "connections": []
-            }
+        config_service.update('ssh', mutate)
+        return True
     except Exception as e:
-        logger.error(f"Error loading SSH config: {e}")
-        # Return default config
-        return {
-            "connections": []
-        }
+        logger.error(f"Error saving SSH config: {e}")
+        return False
 
 def save_ssh_config(config):
     """Save SSH configuration to file"""
     try:
-        with open(SSH_CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        config_service.save('ssh', config)
         return True
     except Exception as e:
         logger.error(f"Error saving SSH config: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,190 @@
+"""
+Log Search Utility
+Searches script log segments, using their trigram filters to skip segments that cannot match
+"""
+
+import os
+import re
+import time
+import threading
+import warnings
+from app.utils.log_segments import LogSegment, extract_trigrams
+
+# Python 3.11起sre_parse改为re._parser，旧名称仍可导入但会给出DeprecationWarning
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import sre_parse
+        import sre_constants
+except ImportError:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+
+# 日志文件名: <脚本>_<任务>.log[.<序号>][.gz]
+SEGMENT_NAME = re.compile(r'^(?P<base>.+\.log)(?:\.(?P<seq>\d+))?(?P<gz>\.gz)?$')
+
+
+def required_literals(pattern, flags=0):
+    """
+    从正则表达式顶层提取匹配时必须出现的连续字面量，返回 (字面量列表, 解析后的flags)
+    flags包含 (?i) 等内联标志；遇到分支、分组、字符类等无法确定的结构时断开，解析失败时返回空列表
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return [], flags
+    literals = []
+    current = []
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            current.append(chr(av))
+            continue
+        if current:
+            literals.append(''.join(current))
+            current = []
+    if current:
+        literals.append(''.join(current))
+    # Python 3.7及以前为parsed.pattern
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    return literals, state.flags
+
+
+def query_trigrams(literals, ignore_case):
+    """查询必须包含的三元组，忽略大小写时只保留ASCII三元组（位图只对ASCII做了小写）"""
+    trigrams = set()
+    for literal in literals:
+        trigrams |= extract_trigrams(literal.encode('utf-8'))
+    if ignore_case:
+        trigrams = {t for t in trigrams if max(t) < 0x80}
+    return trigrams
+
+
+class LogSearcher:
+    """在script_logs中的全部日志分段上搜索"""
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self._cache = {}   # 索引文件路径 -> (mtime_ns, LogSegment)
+        self.lock = threading.Lock()
+
+    def _load(self, idx_path):
+        """加载分段索引，索引文件未变化时复用缓存"""
+        mtime = os.stat(idx_path).st_mtime_ns
+        with self.lock:
+            cached = self._cache.get(idx_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        segment = LogSegment.load(idx_path[:-len('.idx')])
+        with self.lock:
+            self._cache[idx_path] = (mtime, segment)
+        return segment
+
+    def collect_segments(self, loggers=()):
+        """
+        返回 [(日志名, [分段...])]，最近修改的日志在前
+        运行中的日志直接使用内存中的分段，其余从磁盘的索引文件加载
+        """
+        logs = {}
+        for logger in loggers:
+            logs[os.path.basename(logger.log_file_path)] = (time.time(), logger.snapshot_segments())
+
+        on_disk = {}
+        try:
+            entries = list(os.scandir(self.log_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.name.endswith('.idx'):
+                continue
+            match = SEGMENT_NAME.match(entry.name[:-len('.idx')])
+            if match is None or match.group('base') in logs:
+                continue
+            seq = int(match.group('seq') or 0)
+            segments = on_disk.setdefault(match.group('base'), {})
+            # 压缩过程中可能同时存在压缩前后的索引，优先使用压缩后的
+            if seq not in segments or match.group('gz'):
+                segments[seq] = entry.path
+
+        # 清理已删除的索引缓存
+        live = {path for segments in on_disk.values() for path in segments.values()}
+        with self.lock:
+            for path in [path for path in self._cache if path not in live]:
+                del self._cache[path]
+
+        for base, paths in on_disk.items():
+            segments = []
+            for path in paths.values():
+                try:
+                    segments.append(self._load(path))
+                except (OSError, ValueError, KeyError):
+                    continue
+            segments.sort(key=lambda s: s.first_line)
+            modified = max((s.created_at or 0 for s in segments), default=0)
+            logs[base] = (modified, segments)
+
+        return [(name, segments) for name, (_, segments)
+                in sorted(logs.items(), key=lambda item: item[1][0], reverse=True)]
+
+    def search(self, query, regex=False, ignore_case=True, limit=100, loggers=(), log_filter=None):
+        """
+        搜索生成器：逐条产出 {'type': 'match', ...}，最后产出一条 {'type': 'summary', ...}
+        达到limit后立即停止
+        """
+        started = time.monotonic()
+        flags = re.IGNORECASE if ignore_case else 0
+        pattern = query if regex else re.escape(query)
+        matcher = re.compile(pattern, flags)
+        literals, parsed_flags = required_literals(pattern, flags)
+        # 内联的 (?i) 同样使匹配忽略大小写，预过滤不能排除正则能匹配的分段
+        trigrams = query_trigrams(literals, ignore_case or bool(parsed_flags & re.IGNORECASE))
+
+        matches = 0
+        scanned = skipped = 0
+        truncated = False
+        for name, segments in self.collect_segments(loggers):
+            if log_filter and log_filter not in name:
+                continue
+            for segment in segments:
+                if not segment.might_contain(trigrams):
+                    skipped += 1
+                    continue
+                scanned += 1
+                for offset, line in self._iter_lines(segment):
+                    if matcher.search(line):
+                        matches += 1
+                        yield {'type': 'match', 'log': name, 'line': offset, 'text': line}
+                        if matches >= limit:
+                            truncated = True
+                            break
+                if truncated:
+                    break
+            if truncated:
+                break
+
+        yield {
+            'type': 'summary',
+            'matches': matches,
+            'truncated': truncated,
+            'segments_scanned': scanned,
+            'segments_skipped': skipped,
+            'elapsed': time.monotonic() - started
+        }
+
+    def _iter_lines(self, segment):
+        """逐块读取分段，返回 (行号, 行)"""
+        block = 0
+        while block < len(segment.index):
+            try:
+                first, lines = segment.read_block(block)
+            except FileNotFoundError:
+                # 读取过程中分段被压缩替换，索引块一一对应，从压缩文件继续
+                if segment.compressed or not os.path.exists(segment.path + '.gz.idx'):
+                    return
+                segment = LogSegment.load(segment.path + '.gz')
+                continue
+            except ValueError:
+                # 活动分段尚未写入文件
+                return
+            for i, line in enumerate(lines):
+                yield first + i, line
+            block += 1
@@ -0,0 +1,250 @@
+"""
+Log Segments Utility
+Indexed, optionally compressed log file segments for fast tail and time range reads
+
+每个日志分段带有稀疏索引：每 INDEX_INTERVAL 行记录一次 (行号, 时间戳, 字节偏移)。
+压缩分段由多个独立的gzip成员拼接而成（仍是合法的gzip文件），每个成员对应一个索引块，
+读取时只需二分查找索引，再通过mmap解压对应的一个块，不需要读取整个文件。
+分段结束写入时还会生成三元组（trigram）位图，搜索时用来跳过不可能匹配的分段。
+"""
+
+import os
+import json
+import gzip
+import mmap
+import zlib
+import base64
+import bisect
+
+# 稀疏索引间隔（行）
+INDEX_INTERVAL = 256
+# 日志时间戳在行中的位置: "[YYYY-mm-dd HH:MM:SS] ..."
+TIMESTAMP_SLICE = slice(1, 20)
+# 三元组位图大小（字节），按小写后的UTF-8字节计算
+TRIGRAM_FILTER_BYTES = 32 * 1024
+TRIGRAM_FILTER_MASK = TRIGRAM_FILTER_BYTES * 8 - 1
+
+
+def extract_trigrams(data):
+    """提取字节串中所有（小写后的）三元组"""
+    data = data.lower()
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+
+def build_trigram_filter(trigrams):
+    """将三元组集合写入固定大小的位图"""
+    bits = bytearray(TRIGRAM_FILTER_BYTES)
+    for trigram in trigrams:
+        h = zlib.crc32(trigram) & TRIGRAM_FILTER_MASK
+        bits[h >> 3] |= 1 << (h & 7)
+    return bytes(bits)
+
+
+class LogSegment:
+    """一个日志分段及其稀疏索引"""
+
+    def __init__(self, path, first_line, compressed=False):
+        self.path = path
+        self.first_line = first_line   # 分段第一行的全局行号
+        self.lines = 0
+        self.size = 0                  # 未压缩时为文件字节数，压缩后为压缩文件字节数
+        self.compressed = compressed
+        self.first_ts = None
+        self.last_ts = None
+        self.created_at = None
+        self.index = []                # [(行号, 时间戳, 字节偏移)]
+        self.line_keys = []            # 索引中的行号，二分查找用，与index同步追加
+        self.time_keys = []            # 索引中的时间戳
+        self.trigrams = None           # 三元组位图，分段写完后才生成
+
+    @property
+    def end_line(self):
+        return self.first_line + self.lines
+
+    def add_lines(self, entries):
+        """
+        追加一批已编码的行 [(文本, 字节)] 并更新索引，返回需写入的字节
+        只用于未压缩的活动分段
+        """
+        chunks = []
+        for text, data in entries:
+            if self.lines % INDEX_INTERVAL == 0:
+                self.add_index_entry((self.first_line + self.lines, text[TIMESTAMP_SLICE], self.size))
+            if self.first_ts is None:
+                self.first_ts = text[TIMESTAMP_SLICE]
+            self.last_ts = text[TIMESTAMP_SLICE]
+            self.lines += 1
+            self.size += len(data)
+            chunks.append(data)
+        return b''.join(chunks)
+
+    def add_index_entry(self, entry):
+        # 先追加index，并发查找时由键得到的块号总在index范围内
+        self.index.append(entry)
+        self.line_keys.append(entry[0])
+        self.time_keys.append(entry[1])
+
+    def _block_range(self, block):
+        start = self.index[block][2]
+        end = self.index[block + 1][2] if block + 1 < len(self.index) else self.size
+        return start, end
+
+    def read_block(self, block):
+        """读取一个索引块，返回 (块第一行的行号, 行列表)"""
+        start, end = self._block_range(block)
+        if end <= start:
+            return self.index[block][0], []
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[start:end]
+        if self.compressed:
+            data = gzip.decompress(data)
+        text = data.decode('utf-8', errors='replace')
+        return self.index[block][0], text.split('\n')[:-1]
+
+    def build_filter(self):
+        """逐块读取分段并生成三元组位图"""
+        trigrams = set()
+        for block in range(len(self.index)):
+            start, end = self._block_range(block)
+            if end <= start:
+                continue
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start)
+            if self.compressed:
+                data = gzip.decompress(data)
+            trigrams |= extract_trigrams(data)
+        self.trigrams = build_trigram_filter(trigrams)
+
+    def might_contain(self, trigrams):
+        """位图中是否包含全部三元组（没有位图时总是返回True）"""
+        if self.trigrams is None:
+            return True
+        bits = self.trigrams
+        for trigram in trigrams:
+            h = zlib.crc32(trigram) & TRIGRAM_FILTER_MASK
+            if not bits[h >> 3] & (1 << (h & 7)):
+                return False
+        return True
+
+    def block_for_line(self, line_no):
+        """包含指定行号的索引块"""
+        return max(bisect.bisect_right(self.line_keys, line_no) - 1, 0)
+
+    def block_for_time(self, timestamp):
+        """可能包含不早于timestamp的第一行的索引块"""
+        block = bisect.bisect_left(self.time_keys, timestamp)
+        return max(block - 1, 0)
+
+    def read_lines(self, since, limit):
+        """读取从行号since开始的最多limit行"""
+        lines = []
+        if not self.index or since >= self.end_line:
+            return lines
+        block = self.block_for_line(since)
+        while block < len(self.index) and len(lines) < limit:
+            first, block_lines = self.read_block(block)
+            skip = max(since - first, 0)
+            lines.extend(block_lines[skip:skip + limit - len(lines)])
+            block += 1
+        return lines
+
+    def read_between(self, start_ts, end_ts, limit):
+        """读取时间戳在 [start_ts, end_ts] 内的最多limit行，返回 (行号, 行) 列表"""
+        result = []
+        if not self.index or self.last_ts < start_ts or self.first_ts > end_ts:
+            return result
+        block = self.block_for_time(start_ts)
+        while block < len(self.index) and len(result) < limit:
+            first, block_lines = self.read_block(block)
+            for i, line in enumerate(block_lines):
+                timestamp = line[TIMESTAMP_SLICE]
+                if timestamp > end_ts:
+                    return result
+                if timestamp >= start_ts:
+                    result.append((first + i, line))
+                    if len(result) >= limit:
+                        break
+            block += 1
+        return result
+
+    def to_dict(self):
+        return {
+            'path': os.path.basename(self.path),
+            'first_line': self.first_line,
+            'lines': self.lines,
+            'size': self.size,
+            'compressed': self.compressed,
+            'first_ts': self.first_ts,
+            'last_ts': self.last_ts,
+            'created_at': self.created_at,
+            'index': self.index,
+            'trigrams': base64.b64encode(self.trigrams).decode('ascii') if self.trigrams else None
+        }
+
+    def save_index(self):
+        """将索引写入旁路文件 <分段>.idx"""
+        tmp_path = self.path + '.idx.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self.path + '.idx')
+
+    @classmethod
+    def load(cls, path):
+        """从旁路索引文件加载分段"""
+        with open(path + '.idx', 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        segment = cls(path, data['first_line'], data['compressed'])
+        segment.lines = data['lines']
+        segment.size = data['size']
+        segment.first_ts = data['first_ts']
+        segment.last_ts = data['last_ts']
+        segment.created_at = data.get('created_at')
+        for entry in data['index']:
+            segment.add_index_entry(tuple(entry))
+        if data.get('trigrams'):
+            segment.trigrams = base64.b64decode(data['trigrams'])
+        return segment
+
+
+def compress_segment(segment):
+    """
+    将未压缩的分段按索引块压缩为多个gzip成员，返回新的压缩分段
+    原文件和压缩文件在调用方切换元数据后再删除
+    """
+    compressed_path = segment.path + '.gz'
+    compressed = LogSegment(compressed_path, segment.first_line, compressed=True)
+    compressed.lines = segment.lines
+    compressed.first_ts = segment.first_ts
+    compressed.last_ts = segment.last_ts
+    compressed.created_at = segment.created_at
+
+    offset = 0
+    trigrams = set()
+    with open(segment.path, 'rb') as src, open(compressed_path + '.tmp', 'wb') as dst:
+        for block, (line_no, timestamp, _) in enumerate(segment.index):
+            start, end = segment._block_range(block)
+            src.seek(start)
+            data = src.read(end - start)
+            trigrams |= extract_trigrams(data)
+            member = gzip.compress(data, compresslevel=6)
+            dst.write(member)
+            compressed.add_index_entry((line_no, timestamp, offset))
+            offset += len(member)
+        dst.flush()
+        os.fsync(dst.fileno())
+    compressed.size = offset
+    compressed.trigrams = build_trigram_filter(trigrams)
+    os.replace(compressed_path + '.tmp', compressed_path)
+    compressed.save_index()
+    return compressed
+
+
+def remove_segment_files(segment):
+    """删除分段文件及其索引"""
+    for path in (segment.path, segment.path + '.idx'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
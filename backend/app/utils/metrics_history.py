@@ -0,0 +1,186 @@
+"""
+Metrics History Utility
+Keeps a fixed-memory, multi-resolution history of system metrics
+"""
+
+import threading
+from array import array
+
+
+# 记录的指标及其在采样快照中的取值方式
+METRIC_GETTERS = {
+    'cpu': lambda s: s['cpu']['percent'],
+    'memory': lambda s: s['memory']['percent'],
+    'memory_used': lambda s: s['memory']['used'],
+    'disk': lambda s: max([d['percent'] for d in s['disks']] or [0]),
+}
+
+# 各分辨率：(步长秒数, 保留点数)，原始1秒保留1小时，10秒保留1天，1分钟保留7天
+DEFAULT_RESOLUTIONS = [
+    (1, 3600),
+    (10, 8640),
+    (60, 10080),
+]
+
+
+class RingBuffer:
+    """定长环形缓冲区，每个指标一列 array('d')，内存占用固定"""
+
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.columns = {name: array('d', bytes(8 * capacity)) for name in columns}
+        self.start = 0   # 最旧数据的位置
+        self.size = 0
+
+    def append(self, timestamp, values):
+        """追加一个数据点，缓冲区满时覆盖最旧的数据"""
+        if self.size < self.capacity:
+            index = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.timestamps[index] = timestamp
+        for name, column in self.columns.items():
+            column[index] = values.get(name, 0.0)
+
+    def _index(self, position):
+        return (self.start + position) % self.capacity
+
+    def _bisect(self, timestamp, right=False):
+        """二分查找时间戳的逻辑位置（时间戳按写入顺序单调递增）"""
+        low, high = 0, self.size
+        while low < high:
+            mid = (low + high) // 2
+            value = self.timestamps[self._index(mid)]
+            if value < timestamp or (right and value == timestamp):
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def oldest(self):
+        return self.timestamps[self.start] if self.size else None
+
+    def query(self, since, until, names):
+        """按时间顺序返回[since, until]内的时间戳和指定指标列"""
+        first = self._bisect(since)
+        last = self._bisect(until, right=True)
+        positions = [self._index(p) for p in range(first, last)]
+        timestamps = [self.timestamps[i] for i in positions]
+        columns = {}
+        for name in names:
+            column = self.columns[name]
+            columns[name] = [column[i] for i in positions]
+        return timestamps, columns
+
+
+class MetricsHistory:
+    """多分辨率指标历史：原始采样 + 10秒/1分钟均值汇总"""
+
+    def __init__(self, resolutions=None):
+        self.metrics = list(METRIC_GETTERS)
+        self.resolutions = []
+        for step, capacity in (resolutions or DEFAULT_RESOLUTIONS):
+            self.resolutions.append({
+                'step': step,
+                'buffer': RingBuffer(capacity, self.metrics),
+                'bucket': None,   # 当前正在汇总的时间桶
+                'sums': dict.fromkeys(self.metrics, 0.0),
+                'count': 0,
+            })
+        self.lock = threading.Lock()
+
+    def record(self, snapshot):
+        """记录一次采样快照（作为采样器的订阅回调）"""
+        timestamp = snapshot['timestamp']
+        values = {}
+        for name, getter in METRIC_GETTERS.items():
+            try:
+                values[name] = float(getter(snapshot))
+            except (KeyError, TypeError, ValueError):
+                values[name] = 0.0
+
+        with self.lock:
+            for resolution in self.resolutions:
+                self._accumulate(resolution, timestamp, values)
+
+    def _accumulate(self, resolution, timestamp, values):
+        step = resolution['step']
+        bucket = timestamp - timestamp % step
+        if resolution['bucket'] is not None and bucket != resolution['bucket']:
+            self._flush(resolution)
+        resolution['bucket'] = bucket
+        sums = resolution['sums']
+        for name, value in values.items():
+            sums[name] += value
+        resolution['count'] += 1
+
+    def _flush(self, resolution):
+        """将已结束的时间桶写入缓冲区"""
+        count = resolution['count']
+        if count:
+            sums = resolution['sums']
+            resolution['buffer'].append(
+                resolution['bucket'],
+                {name: total / count for name, total in sums.items()}
+            )
+        resolution['sums'] = dict.fromkeys(self.metrics, 0.0)
+        resolution['count'] = 0
+
+    def query(self, names, since, until, step=None):
+        """
+        查询历史数据，自动选择能覆盖时间范围的最细分辨率，
+        请求的步长更大时再按步长做均值降采样
+        """
+        step = step or 0
+        with self.lock:
+            chosen = self._choose_resolution(since, step)
+            timestamps, columns = chosen['buffer'].query(since, until, names)
+            base_step = chosen['step']
+
+        if step > base_step:
+            timestamps, columns = _downsample(timestamps, columns, step)
+            base_step = step
+        return base_step, timestamps, columns
+
+    def _choose_resolution(self, since, step):
+        covering = [r for r in self.resolutions
+                    if r['buffer'].size and r['buffer'].oldest() <= since]
+        if covering:
+            # 优先选步长不超过请求步长的最粗分辨率，减少降采样的工作量
+            fitting = [r for r in covering if r['step'] <= step]
+            return fitting[-1] if fitting else covering[0]
+        # 没有分辨率能覆盖整个范围时，选数据最久远的一个（按首个时间桶的结束时间比较）
+        filled = [r for r in self.resolutions if r['buffer'].size]
+        if not filled:
+            return self.resolutions[0]
+        return min(filled, key=lambda r: r['buffer'].oldest() + r['step'])
+
+
+def _downsample(timestamps, columns, step):
+    """按步长对数据做均值降采样"""
+    result_timestamps = []
+    result_columns = {name: [] for name in columns}
+    bucket = None
+    sums = {}
+    count = 0
+    for i, timestamp in enumerate(timestamps):
+        current = timestamp - timestamp % step
+        if bucket is not None and current != bucket:
+            result_timestamps.append(bucket)
+            for name in columns:
+                result_columns[name].append(sums[name] / count)
+            count = 0
+        if count == 0:
+            sums = dict.fromkeys(columns, 0.0)
+        bucket = current
+        for name, values in columns.items():
+            sums[name] += values[i]
+        count += 1
+    if count:
+        result_timestamps.append(bucket)
+        for name in columns:
+            result_columns[name].append(sums[name] / count)
+    return result_timestamps, result_columns
@@ -0,0 +1,87 @@
+"""
+Metrics Stream Utility
+Fans out system sampler snapshots to all connected stream clients
+"""
+
+import json
+import threading
+
+
+def diff_snapshot(previous, current):
+    """计算两次快照之间变化的字段，嵌套字典逐层比较，列表整体替换"""
+    changed = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if old == value:
+            continue
+        if isinstance(value, dict) and isinstance(old, dict):
+            changed[key] = diff_snapshot(old, value)
+        else:
+            changed[key] = value
+    return changed
+
+
+class MetricsBroadcaster:
+    """
+    系统指标广播器：每次采样只做一次差分和序列化，
+    所有连接的客户端共享同一份帧数据
+    """
+
+    def __init__(self, keepalive=15):
+        self.keepalive = keepalive
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.snapshot = None
+        self.full_frame = None    # 完整快照
+        self.delta_frame = None   # 相对上一帧的变化字段
+        self.clients = 0
+
+    def publish(self, snapshot):
+        """发布新的快照（作为采样器的订阅回调）"""
+        previous = self.snapshot
+        seq = self.seq + 1
+        full_frame = json.dumps({'seq': seq, 'type': 'full', 'data': snapshot}, separators=(',', ':'))
+        delta_frame = None
+        if previous is not None:
+            delta_frame = json.dumps({
+                'seq': seq,
+                'type': 'delta',
+                'data': diff_snapshot(previous, snapshot)
+            }, separators=(',', ':'))
+
+        with self.condition:
+            self.seq = seq
+            self.snapshot = snapshot
+            self.full_frame = full_frame
+            self.delta_frame = delta_frame
+            self.condition.notify_all()
+
+    def stream(self):
+        """生成Server-Sent Events数据，客户端断开时由框架关闭生成器"""
+        with self.condition:
+            self.clients += 1
+        try:
+            last_seq = None
+            while True:
+                with self.condition:
+                    if self.seq == last_seq or self.full_frame is None:
+                        self.condition.wait(timeout=self.keepalive)
+                    seq = self.seq
+                    full_frame = self.full_frame
+                    delta_frame = self.delta_frame
+
+                if full_frame is None or seq == last_seq:
+                    # 保持连接，防止代理超时断开
+                    yield ': keepalive\n\n'
+                    continue
+
+                # 只有紧接着上一帧时才能发送差分，否则（首帧或跳帧）发送完整快照
+                if last_seq is not None and seq == last_seq + 1 and delta_frame is not None:
+                    frame = delta_frame
+                else:
+                    frame = full_frame
+                last_seq = seq
+                yield f'id: {seq}\ndata: {frame}\n\n'
+        finally:
+            with self.condition:
+                self.clients -= 1
@@ -0,0 +1,60 @@
+"""
+Path Matcher Utility
+Compiles exclude patterns once so each path is checked with a single call
+"""
+
+import os
+import re
+import fnmatch
+
+GLOB_CHARS = frozenset('*?[')
+# Windows下fnmatch不区分大小写
+IGNORE_CASE = os.path.normcase('A') == 'a'
+
+
+def _has_glob(text):
+    return not GLOB_CHARS.isdisjoint(text)
+
+
+class ExcludeMatcher:
+    """
+    排除规则匹配器，与逐个pattern对完整路径和文件名调用fnmatch的结果一致：
+    不含通配符的pattern放入集合，'*.ext' 形式按后缀匹配，其余合并为一个正则
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        literals = set()
+        suffixes = []
+        globs = []
+        for pattern in self.patterns:
+            pattern = pattern.replace('\\', '/')  # 统一使用正斜杠
+            if IGNORE_CASE:
+                pattern = pattern.lower()
+            if not _has_glob(pattern):
+                literals.add(pattern)
+            elif pattern.startswith('*') and '/' not in pattern and not _has_glob(pattern[1:]):
+                suffixes.append(pattern[1:])
+            else:
+                globs.append(fnmatch.translate(pattern))
+        self.literals = frozenset(literals)
+        self.suffixes = tuple(suffixes)
+        self.regex = re.compile('|'.join(globs)) if globs else None
+
+    def __call__(self, path, name=None):
+        """path是否被排除，name为文件名（已知时传入可省去拆分路径）"""
+        if '\\' in path:
+            path = path.replace('\\', '/')
+        if IGNORE_CASE:
+            path = path.lower()
+            name = name.lower() if name is not None else None
+        if name is None:
+            name = path.rpartition('/')[2]
+        if name in self.literals or path in self.literals:
+            return True
+        # 后缀不含'/'，对文件名和完整路径的结果相同
+        if self.suffixes and name.endswith(self.suffixes):
+            return True
+        if self.regex is not None:
+            return self.regex.match(name) is not None or self.regex.match(path) is not None
+        return False
@@ -11,60 +11,158 @@ from datetime import datetime
 from app.utils.config_loader import load_monitor_config
 
 
+# /proc/<pid>/stat 中第22个字段为进程启动时间（开机后的时钟滴答数）
+_STAT_STARTTIME = 19
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PROC_AVAILABLE = os.path.isdir('/proc/self')
+
+
+def _is_python_name(name):
+    # 检查进程是否为Python进程
+    name = name.lower()
+    return 'python' in name
+
+
+def _read_proc_stat(pid):
+    """读取 /proc/<pid>/stat，返回 (进程名, 启动时钟滴答数)，只需一次小文件读取"""
+    with open(f'/proc/{pid}/stat', 'rb') as f:
+        data = f.read()
+    # 进程名可能包含空格和括号，取最后一个右括号
+    lpar = data.find(b'(')
+    rpar = data.rfind(b')')
+    name = data[lpar + 1:rpar].decode('utf-8', errors='replace')
+    return name, int(data[rpar + 2:].split()[_STAT_STARTTIME])
+
+
+def _read_cmdline(pid):
+    if PROC_AVAILABLE:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            data = f.read()
+        return [arg.decode('utf-8', errors='replace') for arg in data.split(b'\0') if arg]
+    return psutil.Process(pid).cmdline()
+
+
+# 带参数的解释器选项，参数可能是下一项
+_OPTIONS_WITH_ARG = ('-W', '-X')
+
+
+def _script_argument(cmdline):
+    """
+    跳过解释器选项（如 -u、-X dev），返回 (脚本参数, 是否为 -c 命令)
+    没有脚本参数时返回 (None, False)
+    """
+    args = iter(cmdline[1:])
+    for arg in args:
+        if arg == '--':
+            return next(args, None), False
+        if not arg.startswith('-') or arg == '-':
+            return arg, False
+        if arg == '-c':
+            return None, True
+        if arg == '-m':
+            # 以模块方式运行，没有脚本文件
+            return next(args, None), False
+        if arg in _OPTIONS_WITH_ARG:
+            next(args, None)
+    return None, False
+
+
+def _describe_process(pid, cmdline, create_time):
+    """根据命令行生成进程信息，不是Python脚本进程时返回None"""
+    if not cmdline:
+        return None
+    start_time = datetime.fromtimestamp(create_time).strftime('%Y-%m-%d %H:%M:%S')
+    # 第一个参数通常是python解释器
+    script_path, command = _script_argument(cmdline)
+    if script_path is not None:
+        # 检查是否为Python脚本
+        if script_path.endswith('.py'):
+            script_name = os.path.basename(script_path)
+        else:
+            return None
+    elif command:
+        # 也包括直接用python -c命令运行的情况
+        script_name = 'python -c command'
+        script_path = 'N/A'
+    else:
+        # 只有python命令，没有脚本参数
+        script_name = 'python interpreter'
+        script_path = 'N/A'
+    return {
+        'pid': pid,
+        'script_name': script_name,
+        'script_path': script_path,
+        'cmdline': ' '.join(cmdline),
+        'start_time': start_time
+    }
+
+
+class PythonProcessTable:
+    """
+    Python进程缓存，以 (pid, 启动时间) 识别进程：
+    每次扫描只读取各进程的 /proc/<pid>/stat，命令行只在新出现的python进程上读取一次
+    """
+
+    def __init__(self):
+        self.entries = {}   # pid -> (启动标识, create_time, 进程信息或None)
+        self.lock = threading.Lock()
+        self.boot_time = psutil.boot_time()
+
+    def _identify(self, pid):
+        """返回 (进程名, 启动标识)，启动标识只用于比较，不做换算"""
+        if PROC_AVAILABLE:
+            return _read_proc_stat(pid)
+        proc = psutil.Process(pid)
+        with proc.oneshot():
+            return proc.name(), proc.create_time()
+
+    def _create_time(self, start):
+        if PROC_AVAILABLE:
+            return self.boot_time + start / _CLOCK_TICKS
+        return start
+
+    def scan(self):
+        """扫描进程，返回 [(pid, create_time, 进程信息)]"""
+        with self.lock:
+            pids = psutil.pids()
+            alive = set(pids)
+            for pid in [pid for pid in self.entries if pid not in alive]:
+                del self.entries[pid]
+
+            result = []
+            for pid in pids:
+                try:
+                    name, start = self._identify(pid)
+                except (OSError, ValueError, IndexError, psutil.Error):
+                    # 进程已退出或无权限
+                    self.entries.pop(pid, None)
+                    continue
+                cached = self.entries.get(pid)
+                if cached is None or cached[0] != start:
+                    # 新进程（或pid被复用），只有python进程才读取命令行
+                    create_time = self._create_time(start)
+                    info = None
+                    if _is_python_name(name):
+                        try:
+                            info = _describe_process(pid, _read_cmdline(pid), create_time)
+                        except (OSError, psutil.Error):
+                            continue
+                    cached = (start, create_time, info)
+                    self.entries[pid] = cached
+                if cached[2] is not None:
+                    result.append((pid, cached[1], cached[2]))
+            return result
+
+
+python_process_table = PythonProcessTable()
+
+
 def get_python_processes():
     """
     Get all running Python processes with their details
+    Served from the process table cache, the returned dicts are shared and must not be modified
     """
-    processes = []
-    for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'create_time']):
-        try:
-            # 检查进程是否为Python进程 - 改进检测逻辑
-            name = proc.info['name'].lower() if proc.info['name'] else ''
-            is_python_process = (
-                'python' in name or 
-                name in ['python', 'python3', 'python.exe', 'python3.exe']
-            )
-            
-            if is_python_process:
-                # 检查命令行参数
-                cmdline = proc.info['cmdline']
-                if cmdline and len(cmdline) > 0:
-                    # 第一个参数通常是python解释器
-                    if len(cmdline) > 1:
-                        script_path = cmdline[1]
-                        # 获取脚本名称
-                        script_name = os.path.basename(script_path)
-                        
-                        # 检查是否为Python脚本
-                        if script_path.endswith('.py'):
-                            processes.append({
-                                'pid': proc.info['pid'],
-                                'script_name': script_name,
-                                'script_path': script_path,
-                                'cmdline': ' '.join(cmdline),
-                                'start_time': datetime.fromtimestamp(proc.info['create_time']).strftime('%Y-%m-%d %H:%M:%S')
-                            })
-                        # 也包括直接用python -c命令运行的情况
-                        elif '-c' in cmdline:
-                            processes.append({
-                                'pid': proc.info['pid'],
-                                'script_name': 'python -c command',
-                                'script_path': 'N/A',
-                                'cmdline': ' '.join(cmdline),
-                                'start_time': datetime.fromtimestamp(proc.info['create_time']).strftime('%Y-%m-%d %H:%M:%S')
-                            })
-                    else:
-                        # 只有python命令，没有脚本参数
-                        processes.append({
-                            'pid': proc.info['pid'],
-                            'script_name': 'python interpreter',
-                            'script_path': 'N/A',
-                            'cmdline': ' '.join(cmdline),
-                            'start_time': datetime.fromtimestamp(proc.info['create_time']).strftime('%Y-%m-%d %H:%M:%S')
-                        })
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-    return processes
+    return [info for _, _, info in python_process_table.scan()]
 
 
 def get_all_python_scripts(app):
@@ -136,22 +234,24 @@ def get_all_python_scripts(app):
 def capture_process_output(process, logger):
     """
     Capture stdout and stderr from a process and log it
+    Returns the reader threads so callers can wait for the output to drain
     """
-    def log_output(pipe):
+    def log_output(pipe, stream):
         for line in iter(pipe.readline, b''):
             try:
                 decoded_line = line.decode('utf-8', errors='ignore').rstrip()
-                logger.append_log(decoded_line)
+                logger.append_log(decoded_line, stream)
             except Exception as e:
                 logger.append_log(f"Error decoding line: {e}")
         pipe.close()
     
     # Start threads to capture stdout and stderr
-    stdout_thread = threading.Thread(target=log_output, args=(process.stdout,))
-    stderr_thread = threading.Thread(target=log_output, args=(process.stderr,))
+    stdout_thread = threading.Thread(target=log_output, args=(process.stdout, 'stdout'))
+    stderr_thread = threading.Thread(target=log_output, args=(process.stderr, 'stderr'))
     
     stdout_thread.daemon = True
     stderr_thread.daemon = True
     
     stdout_thread.start()
-    stderr_thread.start()
\ No newline at end of file
+    stderr_thread.start()
+    return stdout_thread, stderr_thread
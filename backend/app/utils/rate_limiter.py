@@ -0,0 +1,50 @@
+"""
+Rate Limiter Utility
+Token bucket rate limiting keyed by client IP, user name, etc.
+"""
+
+import time
+import threading
+
+# 最多跟踪的键数量，超出时清理已经回满的桶
+MAX_BUCKETS = 10000
+
+
+class TokenBucketLimiter:
+    """
+    令牌桶限流：每个键最多积累capacity个令牌，每秒补充rate个，
+    每次请求消耗一个令牌，没有令牌时拒绝
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.buckets = {}   # key -> (tokens, 上次更新的monotonic时间)
+        self.lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self.buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def acquire(self, key):
+        """尝试消耗一个令牌，返回 (是否允许, 需要等待的秒数)"""
+        now = time.monotonic()
+        with self.lock:
+            tokens = self._tokens(key, now)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return False, (1 - tokens) / self.rate
+            self.buckets[key] = (tokens - 1, now)
+            if len(self.buckets) > MAX_BUCKETS:
+                self._prune(now)
+            return True, 0.0
+
+    def reset(self, key):
+        """清除某个键的限流状态（如登录成功后）"""
+        with self.lock:
+            self.buckets.pop(key, None)
+
+    def _prune(self, now):
+        """删除已经回满的桶，它们和不存在时等价（需持有锁）"""
+        for key in [key for key in self.buckets if self._tokens(key, now) >= self.capacity]:
+            del self.buckets[key]
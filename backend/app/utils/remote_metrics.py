@@ -0,0 +1,242 @@
+"""
+Remote Metrics Utility
+Collects CPU, memory, disk and load of SSH-connected hosts with one batched probe per sample
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# 采样间隔（秒）
+REMOTE_METRICS_INTERVAL = 10
+# 单个主机采样的超时（秒）
+REMOTE_METRICS_TIMEOUT = 10
+REMOTE_METRICS_WORKERS = 16
+# 不统计的伪文件系统
+PSEUDO_FILESYSTEMS = ('tmpfs', 'devtmpfs', 'udev', 'none', 'shm', 'overlay', 'squashfs')
+
+# 一次exec读取全部/proc数据，各段以 @名称 开头，在本地解析
+PROBE_COMMAND = (
+    "printf '@stat\\n'; head -1 /proc/stat; grep -c '^cpu[0-9]' /proc/stat; "
+    "printf '@meminfo\\n'; cat /proc/meminfo; "
+    "printf '@loadavg\\n'; cat /proc/loadavg; "
+    "printf '@uptime\\n'; cat /proc/uptime; "
+    "printf '@df\\n'; df -kP 2>/dev/null"
+)
+
+
+def split_sections(output):
+    """把探测输出按 @名称 拆分为 {名称: [行]}"""
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith('@') and ' ' not in line:
+            current = sections.setdefault(line[1:], [])
+        elif current is not None and line.strip():
+            current.append(line)
+    return sections
+
+
+def parse_cpu(lines):
+    """返回 (总时钟数, 空闲时钟数, CPU核数)"""
+    fields = [int(value) for value in lines[0].split()[1:]]
+    # idle + iowait 视为空闲
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    # guest已计入user，不重复统计
+    total = sum(fields[:8])
+    count = int(lines[1]) if len(lines) > 1 else None
+    return total, idle, count
+
+
+def parse_meminfo(lines):
+    values = {}
+    for line in lines:
+        name, _, rest = line.partition(':')
+        parts = rest.split()
+        if parts:
+            # /proc/meminfo 以kB为单位
+            values[name] = int(parts[0]) * 1024
+    total = values.get('MemTotal', 0)
+    available = values.get('MemAvailable')
+    if available is None:
+        available = values.get('MemFree', 0) + values.get('Buffers', 0) + values.get('Cached', 0)
+    swap_total = values.get('SwapTotal', 0)
+    swap_used = swap_total - values.get('SwapFree', 0)
+    return {
+        'memory': {
+            'total': total,
+            'available': available,
+            'used': total - available,
+            'free': values.get('MemFree', 0),
+            'percent': (total - available) * 100.0 / total if total else 0
+        },
+        'swap': {
+            'total': swap_total,
+            'used': swap_used,
+            'percent': swap_used * 100.0 / swap_total if swap_total else 0
+        }
+    }
+
+
+def parse_loadavg(lines):
+    parts = lines[0].split()
+    running, _, total = parts[3].partition('/')
+    return {
+        'load1': float(parts[0]),
+        'load5': float(parts[1]),
+        'load15': float(parts[2]),
+        'running': int(running),
+        'processes': int(total)
+    }
+
+
+def parse_df(lines):
+    """解析 df -kP 输出，格式与本机系统信息中的disks一致"""
+    disks = []
+    for line in lines[1:]:
+        parts = line.split()
+        if len(parts) < 6 or parts[0] in PSEUDO_FILESYSTEMS:
+            continue
+        try:
+            total, used, free = int(parts[1]) * 1024, int(parts[2]) * 1024, int(parts[3]) * 1024
+        except ValueError:
+            continue
+        if total == 0:
+            continue
+        disks.append({
+            'device': parts[0],
+            # 挂载点可能包含空格
+            'mountpoint': ' '.join(parts[5:]),
+            'total': total,
+            'used': used,
+            'free': free,
+            'percent': used * 100.0 / total
+        })
+    return disks
+
+
+class RemoteMetricsCollector:
+    """
+    远程主机指标后台采集：按固定间隔并行采样所有已连接的主机，每个主机每次只执行一条命令，
+    缓存每个主机最近一次的结果；共享传输的连接只采样一次
+    """
+
+    def __init__(self, ssh_manager, interval=REMOTE_METRICS_INTERVAL, timeout=REMOTE_METRICS_TIMEOUT):
+        self.ssh_manager = ssh_manager
+        self.interval = max(float(interval), 1.0)
+        self.timeout = timeout
+        self.snapshots = {}   # conn_id -> 最近一次采样结果
+        self.cpu_counters = {}  # 连接池条目key -> (总时钟数, 空闲时钟数)，用于计算两次采样间的CPU使用率
+        self.in_flight = set()  # 正在采样的连接池条目key，上次未完成时跳过
+        self.lock = threading.Lock()
+        self._executor = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动采集线程（重复调用无副作用）"""
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=REMOTE_METRICS_WORKERS,
+                                                thread_name_prefix='ssh-metrics')
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='ssh-metrics-collector')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def get_snapshots(self):
+        with self.lock:
+            return dict(self.snapshots)
+
+    def _run(self):
+        # 按固定节拍采样，采样耗时不会累积成漂移
+        next_tick = time.monotonic()
+        while not self._stop_event.wait(max(next_tick - time.monotonic(), 0)):
+            try:
+                self.collect_all()
+            except Exception as e:
+                print(f"远程主机指标采集失败: {str(e)}")
+            next_tick += self.interval
+            now = time.monotonic()
+            if next_tick < now:
+                next_tick = now + self.interval
+
+    def collect_all(self):
+        """并行采样所有已连接的主机，单个主机超时不会拖慢其他主机"""
+        pool_entries = self.ssh_manager.pool_entries()
+        entries = []
+        with self.lock:
+            for entry, conn_ids in pool_entries:
+                # 只采样已连接的主机，不为采集指标触发重连
+                if conn_ids and entry.is_active() and entry.key not in self.in_flight:
+                    self.in_flight.add(entry.key)
+                    entries.append((entry, conn_ids))
+            # 清理已断开连接的缓存
+            known = {conn_id for _, conn_ids in pool_entries for conn_id in conn_ids}
+            for conn_id in [c for c in self.snapshots if c not in known]:
+                del self.snapshots[conn_id]
+            keys = {entry.key for entry, _ in pool_entries}
+            for key in [k for k in self.cpu_counters if k not in keys]:
+                del self.cpu_counters[key]
+
+        futures = []
+        for entry, conn_ids in entries:
+            future = self._executor.submit(self._collect, entry, conn_ids[0])
+            # 超过本轮等待时间才完成的采样也会写入缓存
+            future.add_done_callback(lambda f, conn_ids=conn_ids: self._store(conn_ids, f.result()))
+            futures.append(future)
+        done, _ = wait(futures, timeout=self.timeout + 1)
+        return len(done)
+
+    def _store(self, conn_ids, result):
+        with self.lock:
+            for conn_id in conn_ids:
+                previous = self.snapshots.get(conn_id)
+                snapshot = dict(result, conn_id=conn_id)
+                if result['error'] is not None and previous is not None:
+                    # 采样失败时保留上次成功的数据，只更新错误信息
+                    snapshot = dict(previous, error=result['error'], failed_at=result['collected_at'])
+                self.snapshots[conn_id] = snapshot
+
+    def _collect(self, entry, conn_id):
+        """在一个主机上执行探测命令并解析"""
+        started = time.monotonic()
+        collected_at = time.time()
+        host, port, username = entry.address
+        result = {'host': host, 'port': port, 'collected_at': collected_at, 'error': None}
+        try:
+            output = self.ssh_manager.execute_command(conn_id, PROBE_COMMAND, timeout=self.timeout)
+            result['latency'] = time.monotonic() - started
+            result.update(self._parse(entry.key, output['stdout']))
+        except Exception as e:
+            result['error'] = str(e)
+        finally:
+            with self.lock:
+                self.in_flight.discard(entry.key)
+        return result
+
+    def _parse(self, key, output):
+        sections = split_sections(output)
+        total, idle, count = parse_cpu(sections['stat'])
+        with self.lock:
+            previous = self.cpu_counters.get(key)
+            self.cpu_counters[key] = (total, idle)
+        cpu_percent = None
+        if previous is not None and total > previous[0]:
+            # 两次采样间的使用率，首次采样时为None
+            cpu_percent = 100.0 * (1 - (idle - previous[1]) / (total - previous[0]))
+        metrics = {
+            'cpu': {'percent': cpu_percent, 'count': count},
+            'load': parse_loadavg(sections['loadavg']),
+            'disks': parse_df(sections.get('df', [])),
+            'uptime': float(sections['uptime'][0].split()[0]) if sections.get('uptime') else None
+        }
+        metrics.update(parse_meminfo(sections['meminfo']))
+        return metrics
@@ -0,0 +1,255 @@
+"""
+Resource Sampler Utility
+Samples CPU, memory, I/O, file descriptors and threads of running Python scripts
+"""
+
+import math
+import time
+import threading
+import psutil
+from app.utils.metrics_history import RingBuffer
+from app.utils.process_manager import python_process_table
+
+# 每个脚本记录的指标
+RESOURCE_METRICS = ('cpu_percent', 'rss', 'read_bytes_per_sec', 'write_bytes_per_sec',
+                    'num_fds', 'num_threads', 'processes')
+# 每个脚本保留的采样点数
+HISTORY_SIZE = 300
+# 最多跟踪的脚本数量，超出时清理最久未出现的脚本
+MAX_SCRIPTS = 500
+PERCENTILES = (50, 95)
+
+
+class ProcessHandle:
+    """预热过的psutil.Process，记录上次采样的CPU时间和I/O计数以计算速率"""
+
+    def __init__(self, pid, start, script, job_id=None):
+        self.proc = psutil.Process(pid)
+        self.start = start      # 进程标识，变化说明pid已被复用
+        self.script = script
+        self.job_id = job_id
+        self.last = None        # (monotonic时间, CPU秒数, 读字节, 写字节)
+
+    def sample(self, now):
+        """采集一次，返回各指标；首次采样只做预热，速率为0"""
+        proc = self.proc
+        with proc.oneshot():
+            cpu = proc.cpu_times()
+            cpu_seconds = cpu.user + cpu.system
+            rss = proc.memory_info().rss
+            num_threads = proc.num_threads()
+            try:
+                io = proc.io_counters()
+                read_bytes, write_bytes = io.read_bytes, io.write_bytes
+            except (psutil.AccessDenied, AttributeError):
+                read_bytes = write_bytes = 0
+            try:
+                num_fds = proc.num_fds()
+            except (psutil.AccessDenied, AttributeError):
+                num_fds = 0
+
+        values = {
+            'cpu_percent': 0.0,
+            'rss': rss,
+            'read_bytes_per_sec': 0.0,
+            'write_bytes_per_sec': 0.0,
+            'num_fds': num_fds,
+            'num_threads': num_threads,
+            'processes': 1,
+        }
+        deltas = (0.0, 0, 0)
+        if self.last is not None:
+            elapsed = now - self.last[0]
+            deltas = (max(cpu_seconds - self.last[1], 0.0),
+                      max(read_bytes - self.last[2], 0),
+                      max(write_bytes - self.last[3], 0))
+            if elapsed > 0:
+                values['cpu_percent'] = deltas[0] * 100.0 / elapsed
+                values['read_bytes_per_sec'] = deltas[1] / elapsed
+                values['write_bytes_per_sec'] = deltas[2] / elapsed
+        self.last = (now, cpu_seconds, read_bytes, write_bytes)
+        return values, deltas
+
+
+class ScriptStats:
+    """单个脚本的汇总：定长历史 + 累计CPU时间和I/O"""
+
+    def __init__(self, script, capacity):
+        self.script = script
+        self.buffer = RingBuffer(capacity, RESOURCE_METRICS)
+        self.latest = None
+        self.pids = []
+        self.jobs = []
+        self.cpu_seconds = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.last_seen = None
+
+    def to_dict(self, since):
+        timestamps, columns = self.buffer.query(since, float('inf'), RESOURCE_METRICS)
+        result = {
+            'script': self.script,
+            'pids': self.pids,
+            'jobs': self.jobs,
+            'samples': len(timestamps),
+            'window': timestamps[-1] - timestamps[0] if timestamps else 0,
+            'last_seen': self.last_seen,
+            'cpu_seconds': self.cpu_seconds,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+        }
+        for name in RESOURCE_METRICS:
+            result[name] = _summarize(columns[name], self.latest.get(name, 0) if self.latest else 0)
+        return result
+
+
+def _percentile(ordered, percent):
+    """最近秩法取百分位"""
+    if not ordered:
+        return 0
+    rank = max(math.ceil(percent / 100.0 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def _summarize(values, current):
+    ordered = sorted(values)
+    summary = {
+        'current': current,
+        'mean': sum(ordered) / len(ordered) if ordered else 0,
+        'max': ordered[-1] if ordered else 0,
+    }
+    for percent in PERCENTILES:
+        summary[f'p{percent}'] = _percentile(ordered, percent)
+    return summary
+
+
+class ResourceSampler:
+    """
+    脚本资源后台采样器：跟踪process_manager发现的Python进程和脚本任务进程，
+    psutil.Process对象跨采样复用，按脚本汇总写入定长环形缓冲区
+    """
+
+    def __init__(self, supervisor=None, interval=2.0, history_size=HISTORY_SIZE):
+        self.supervisor = supervisor
+        self.interval = max(float(interval), 0.1)
+        self.history_size = history_size
+        self.handles = {}   # pid -> ProcessHandle
+        self.scripts = {}   # 脚本 -> ScriptStats
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动采样线程（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        # 先采集一次预热CPU和I/O计数，下一次采样起速率有效
+        self.collect()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        # 按固定节拍采样，采样耗时不会累积成漂移
+        next_tick = time.monotonic() + self.interval
+        while not self._stop_event.wait(max(next_tick - time.monotonic(), 0)):
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"脚本资源采样失败: {str(e)}")
+            next_tick += self.interval
+            now = time.monotonic()
+            if next_tick < now:
+                # 采样过慢时跳过错过的节拍
+                next_tick = now + self.interval
+
+    def _targets(self):
+        """本次要采样的进程：pid -> (进程标识, 脚本, 任务ID)"""
+        targets = {}
+        for pid, create_time, info in python_process_table.scan():
+            script = info['script_path'] if info['script_path'] != 'N/A' else info['script_name']
+            targets[pid] = (create_time, script, None)
+        if self.supervisor is not None:
+            # 脚本任务同样会被进程扫描发现，这里覆盖为任务记录的脚本路径并关联任务ID
+            for job_id, pid, script_path in self.supervisor.running_jobs():
+                targets[pid] = (job_id, script_path, job_id)
+        return targets
+
+    def collect(self):
+        """采集一次所有目标进程，并按脚本写入历史"""
+        targets = self._targets()
+        for pid in [pid for pid in self.handles if pid not in targets]:
+            del self.handles[pid]
+
+        now = time.monotonic()
+        timestamp = time.time()
+        totals = {}   # 脚本 -> (指标之和, 增量之和, pids, jobs)
+        for pid, (start, script, job_id) in targets.items():
+            handle = self.handles.get(pid)
+            try:
+                if handle is None or handle.start != start:
+                    handle = ProcessHandle(pid, start, script, job_id)
+                    self.handles[pid] = handle
+                values, deltas = handle.sample(now)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                self.handles.pop(pid, None)
+                continue
+            except psutil.AccessDenied:
+                continue
+            entry = totals.get(script)
+            if entry is None:
+                entry = totals[script] = (dict.fromkeys(RESOURCE_METRICS, 0), [0.0, 0, 0], [], [])
+            for name, value in values.items():
+                entry[0][name] += value
+            for i, delta in enumerate(deltas):
+                entry[1][i] += delta
+            entry[2].append(pid)
+            if job_id is not None:
+                entry[3].append(job_id)
+
+        with self.lock:
+            for script, (values, deltas, pids, jobs) in totals.items():
+                stats = self.scripts.get(script)
+                if stats is None:
+                    stats = self.scripts[script] = ScriptStats(script, self.history_size)
+                stats.buffer.append(timestamp, values)
+                stats.latest = values
+                stats.pids = pids
+                stats.jobs = jobs
+                stats.cpu_seconds += deltas[0]
+                stats.read_bytes += deltas[1]
+                stats.write_bytes += deltas[2]
+                stats.last_seen = timestamp
+            # 没有运行中进程的脚本保持最后的状态，历史过期或超出数量时清理
+            for script, stats in self.scripts.items():
+                if script not in totals:
+                    stats.latest = None
+                    stats.pids = []
+                    stats.jobs = []
+            self._prune(timestamp)
+
+    def _prune(self, timestamp):
+        """清理历史已全部过期的脚本，以及超出数量上限时最久未出现的脚本（需持有锁）"""
+        expire = timestamp - self.interval * self.history_size
+        for script in [s for s, stats in self.scripts.items() if stats.last_seen < expire]:
+            del self.scripts[script]
+        if len(self.scripts) > MAX_SCRIPTS:
+            ordered = sorted(self.scripts.values(), key=lambda stats: stats.last_seen)
+            for stats in ordered[:len(self.scripts) - MAX_SCRIPTS]:
+                del self.scripts[stats.script]
+
+    def get_stats(self, window=None, running_only=False):
+        """返回各脚本的当前值、均值、百分位和累计值，window为统计的时间范围（秒）"""
+        since = time.time() - window if window else float('-inf')
+        with self.lock:
+            scripts = [stats.to_dict(since) for stats in self.scripts.values()
+                       if not running_only or stats.pids]
+        scripts.sort(key=lambda s: s['cpu_percent']['current'], reverse=True)
+        return scripts
@@ -0,0 +1,468 @@
+"""
+Script Index Utility
+Keeps an in-memory index of Python scripts under the monitored paths, updated by a file system watcher
+"""
+
+import os
+import uuid
+import bisect
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 轮询模式下检查目录mtime的间隔（秒）
+POLL_INTERVAL = 2.0
+# 收到inotify事件后等待一小段时间，合并同一批文件操作
+WATCH_DEBOUNCE = 0.1
+# 并行扫描目录的线程数
+SCAN_WORKERS = 8
+# 脚本列表可排序的字段
+SORT_FIELDS = ('name', 'path', 'mtime', 'size')
+# 字符串前缀范围的上界
+PREFIX_END = '\U0010ffff'
+
+# inotify事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """通过ctypes调用Linux inotify，不可用时构造函数抛出OSError"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """等待并读取事件，返回 [(wd, mask, name)]"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', errors='surrogateescape')
+                offset += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirState:
+    """一个已扫描目录的状态"""
+
+    __slots__ = ('path', 'root', 'key', 'mtime', 'subdirs', 'scripts')
+
+    def __init__(self, path, root, key, mtime, subdirs, scripts):
+        self.path = path
+        self.root = root          # 所属的监控根目录
+        self.key = key            # (st_dev, st_ino)，识别通过不同路径到达的同一目录
+        self.mtime = mtime        # 扫描时目录的mtime_ns
+        self.subdirs = subdirs    # 子目录完整路径集合
+        self.scripts = scripts    # 文件名 -> (size, mtime, (st_dev, st_ino))
+
+
+class ScriptIndex:
+    """
+    脚本索引：启动时完整扫描一次，之后由inotify（不可用时轮询目录mtime）增量更新，
+    列表请求直接读取内存中的结果
+    """
+
+    def __init__(self, monitor_paths, exclude, poll_interval=POLL_INTERVAL):
+        self.monitor_paths = list(monitor_paths)
+        self.exclude = exclude            # exclude(path, name) -> bool，被排除的目录不会进入
+        self.poll_interval = poll_interval
+        self.dirs = {}                    # 目录路径 -> DirState
+        self.lock = threading.RLock()
+        self.version = 0
+        self.token = uuid.uuid4().hex[:8]
+        self.mode = None                  # 'inotify' / 'poll'
+        self.roots = []                   # 最近一次完整扫描时存在的根目录
+        self._scripts = None              # 按版本缓存的脚本列表
+        self._views = {}                  # 排序字段 -> (排好序的脚本列表, 排序键列表)，按版本缓存
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._inotify = None
+        self._watches = {}                # wd -> 目录路径
+        self._watched = {}                # 目录路径 -> wd
+        self._thread = None
+        self._pool = ThreadPoolExecutor(SCAN_WORKERS, thread_name_prefix='script-scan')
+
+    @property
+    def etag(self):
+        return f'{self.token}-{self.version}'
+
+    def start(self):
+        """在后台线程中完成首次扫描并开始监听变化"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='script-index')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def get_scripts(self):
+        """返回 (脚本列表, etag)，首次扫描未完成时等待"""
+        self._ready.wait()
+        with self.lock:
+            if self._scripts is None:
+                self._scripts = self._build_list()
+            return self._scripts, self.etag
+
+    def _build_list(self):
+        scripts = []
+        seen = set()  # 硬链接或符号链接指向同一文件时只保留一个
+        for directory, state in self.dirs.items():
+            for name, (size, mtime, key) in state.scripts.items():
+                if key in seen:
+                    continue
+                seen.add(key)
+                path = os.path.join(directory, name)
+                scripts.append({
+                    'name': name,
+                    'path': path,
+                    'relative_path': os.path.relpath(path, state.root),
+                    'size': size,
+                    'mtime': mtime
+                })
+        return scripts
+
+    def _get_view(self, sort):
+        """按sort字段排序的脚本列表及 (字段值, 路径) 排序键（需持有锁）"""
+        view = self._views.get(sort)
+        if view is None:
+            if self._scripts is None:
+                self._scripts = self._build_list()
+            records = sorted(self._scripts, key=lambda s: (s[sort], s['path']))
+            view = (records, [(s[sort], s['path']) for s in records])
+            self._views[sort] = view
+        return view
+
+    def query(self, sort='name', descending=False, after=None, limit=100,
+              name_prefix=None, path_prefix=None):
+        """
+        分页查询脚本，返回 (脚本列表, 下一页的游标, 总数, etag)
+        after为上一页最后一条的排序键 (字段值, 路径)；有过滤条件时总数为None
+        按name或path排序时前缀过滤直接二分出范围，其它情况从游标处顺序过滤
+        """
+        self._ready.wait()
+        with self.lock:
+            records, keys = self._get_view(sort)
+            etag = self.etag
+
+        lo, hi = 0, len(records)
+        filters = []
+        for field, prefix in (('name', name_prefix), ('path', path_prefix)):
+            if not prefix:
+                continue
+            if field == sort:
+                lo = max(lo, bisect.bisect_left(keys, (prefix,)))
+                hi = min(hi, bisect.bisect_left(keys, (prefix + PREFIX_END,)))
+            else:
+                filters.append((field, prefix))
+
+        if after is not None:
+            if descending:
+                hi = min(hi, bisect.bisect_left(keys, after))
+            else:
+                lo = max(lo, bisect.bisect_right(keys, after))
+
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        page = []
+        more = False
+        for i in positions:
+            record = records[i]
+            if any(not record[field].startswith(prefix) for field, prefix in filters):
+                continue
+            if len(page) >= limit:
+                more = True
+                break
+            page.append(record)
+
+        next_cursor = None
+        if more and page:
+            next_cursor = (page[-1][sort], page[-1]['path'])
+        total = len(records) if not name_prefix and not path_prefix else None
+        return page, next_cursor, total, etag
+
+    def _changed(self):
+        """索引内容变化后调用（需持有锁）"""
+        self.version += 1
+        self._scripts = None
+        self._views = {}
+
+    def _roots(self):
+        """配置中存在的根目录，按真实路径和inode去重，返回 {路径: (st_dev, st_ino)}"""
+        roots = {}
+        for path in self.monitor_paths:
+            path = os.path.realpath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = (stat.st_dev, stat.st_ino)
+            if os.path.isdir(path) and key not in roots.values():
+                roots[path] = key
+        return roots
+
+    def configure(self, monitor_paths, exclude):
+        """监控配置变化后更新路径和排除规则并重新扫描"""
+        with self.lock:
+            self.monitor_paths = list(monitor_paths)
+            self.exclude = exclude
+        self.rebuild()
+
+    def rebuild(self):
+        """完整重新扫描所有监控路径"""
+        roots = self._roots()
+        # 所有根目录一起并行扫描
+        dirs = self._scan_tree([(root, root) for root in roots], set(), roots)
+        with self.lock:
+            self.dirs = dirs
+            self.roots = list(roots)
+            self._changed()
+        self._sync_watches()
+
+    def _scan_dir(self, directory, root):
+        """扫描单个目录，返回DirState，目录不存在时返回None"""
+        try:
+            stat = os.stat(directory)
+            entries = list(os.scandir(directory))
+        except OSError:
+            return None
+        subdirs = set()
+        scripts = {}
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.exclude(entry.path, entry.name):
+                        subdirs.add(entry.path)
+                elif entry.name.endswith('.py') and entry.is_file():
+                    if not self.exclude(entry.path, entry.name):
+                        # DirEntry.stat() 会缓存结果，不再单独stat文件
+                        file_stat = entry.stat()
+                        scripts[entry.name] = (file_stat.st_size, file_stat.st_mtime,
+                                               (file_stat.st_dev, file_stat.st_ino))
+            except OSError:
+                continue
+        return DirState(directory, root, (stat.st_dev, stat.st_ino), stat.st_mtime_ns, subdirs, scripts)
+
+    def _scan_tree(self, starts, seen, roots):
+        """
+        在线程池中并行扫描 [(目录, 所属根目录)] 及其全部子目录，返回 {目录: DirState}
+        seen为已扫描目录的 (st_dev, st_ino)，其它根目录由对应的根目录负责扫描
+        """
+        dirs = {}
+        root_keys = {key: root for root, key in roots.items()}
+        pending = {self._pool.submit(self._scan_dir, directory, root) for directory, root in starts}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                state = future.result()
+                if state is None or state.key in seen:
+                    continue
+                if root_keys.get(state.key, state.root) != state.root:
+                    continue
+                seen.add(state.key)
+                dirs[state.path] = state
+                for subdir in state.subdirs:
+                    pending.add(self._pool.submit(self._scan_dir, subdir, state.root))
+        return dirs
+
+    def _remove_tree(self, directory):
+        """从索引中删除目录及其子目录（需持有锁）"""
+        stack = [directory]
+        while stack:
+            state = self.dirs.pop(stack.pop(), None)
+            if state is not None:
+                stack.extend(state.subdirs)
+
+    def refresh_dir(self, directory):
+        """重新扫描一个目录：更新文件，删除消失的子目录，完整扫描新增的子目录"""
+        with self.lock:
+            old = self.dirs.get(directory)
+        if old is None:
+            return
+        state = self._scan_dir(directory, old.root)
+        added = {}
+        if state is not None:
+            new_subdirs = state.subdirs - old.subdirs
+            if new_subdirs:
+                with self.lock:
+                    seen = {s.key for s in self.dirs.values()}
+                added = self._scan_tree([(subdir, old.root) for subdir in new_subdirs], seen, self._roots())
+        with self.lock:
+            if self.dirs.get(directory) is not old:
+                return
+            if state is None:
+                self._remove_tree(directory)
+                # 父目录也会收到变化，这里只清理自身
+            else:
+                for subdir in old.subdirs - state.subdirs:
+                    self._remove_tree(subdir)
+                self.dirs[directory] = state
+                self.dirs.update(added)
+            if state is None or added or old.subdirs != state.subdirs or old.scripts != state.scripts:
+                self._changed()
+        if state is None or added or old.subdirs != state.subdirs:
+            self._sync_watches()
+
+    def _sync_watches(self):
+        """使inotify监听的目录与索引中的目录一致，监听数不足时切换为轮询"""
+        with self.lock:
+            if self._inotify is None:
+                return
+            self._update_watches(set(self.dirs))
+
+    def _update_watches(self, wanted):
+        for path in [path for path in self._watched if path not in wanted]:
+            wd = self._watched.pop(path)
+            self._watches.pop(wd, None)
+            self._inotify.rm_watch(wd)
+        for path in wanted:
+            if path in self._watched:
+                continue
+            try:
+                wd = self._inotify.add_watch(path)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                # 超过 fs.inotify.max_user_watches 等情况，改用轮询
+                print(f"inotify不可用，改为轮询脚本目录: {str(e)}")
+                self._close_inotify()
+                return
+            self._watches[wd] = path
+            self._watched[path] = wd
+
+    def _close_inotify(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._watches.clear()
+        self._watched.clear()
+        self.mode = 'poll'
+
+    def _run(self):
+        try:
+            self._inotify = Inotify()
+            self.mode = 'inotify'
+        except OSError:
+            self.mode = 'poll'
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"扫描脚本目录失败: {str(e)}")
+        self._ready.set()
+
+        while not self._stop_event.is_set():
+            try:
+                if self._inotify is not None:
+                    self._watch_once()
+                else:
+                    self._poll_once()
+            except Exception as e:
+                print(f"更新脚本索引失败: {str(e)}")
+                self._stop_event.wait(self.poll_interval)
+        self._close_inotify()
+
+    def _watch_once(self):
+        events = self._inotify.read_events(self.poll_interval)
+        if not events:
+            return
+        # 合并短时间内的连续事件
+        self._stop_event.wait(WATCH_DEBOUNCE)
+        events.extend(self._inotify.read_events(0))
+
+        dirty = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.rebuild()
+                return
+            path = self._watches.get(wd)
+            if path is None:
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                self._watched.pop(path, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                dirty.add(os.path.dirname(path))
+            elif name and not mask & IN_ISDIR and not name.endswith('.py'):
+                # 只关心脚本文件和子目录，忽略日志等其它文件的写入
+                continue
+            dirty.add(path)
+        for path in dirty:
+            self.refresh_dir(path)
+        self._check_roots()
+
+    def _poll_once(self):
+        if self._stop_event.wait(self.poll_interval):
+            return
+        with self.lock:
+            known = [(path, state.mtime) for path, state in self.dirs.items()]
+        for path, mtime in known:
+            try:
+                changed = os.stat(path).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.refresh_dir(path)
+        self._check_roots()
+
+    def _check_roots(self):
+        """监控根目录被创建或删除时重新扫描"""
+        if list(self._roots()) != self.roots:
+            self.rebuild()
@@ -0,0 +1,401 @@
+"""
+Script Runner Utility
+Runs Python scripts as background jobs and keeps their output for streaming
+"""
+
+import os
+import sys
+import math
+import time
+import signal
+import uuid
+import heapq
+import itertools
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from app.models.process_logger import ProcessLogger
+from app.utils.process_manager import capture_process_output
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，不支持资源限制
+    resource = None
+
+# 保留的已结束任务数量，超出后清理最早结束的任务
+MAX_FINISHED_JOBS = 100
+# 默认同时运行的任务数量
+DEFAULT_MAX_CONCURRENT = max(os.cpu_count() or 1, 1)
+# 默认最多排队的任务数量
+DEFAULT_MAX_QUEUE = 100
+# 每个脚本保留的最近运行耗时数量，以及最多记录的脚本数量
+LATENCY_HISTORY = 50
+MAX_LATENCY_SCRIPTS = 200
+# 取消运行中的任务时，发送SIGTERM后等待多久再强制结束（秒）
+CANCEL_GRACE_PERIOD = 5
+
+
+class QueueFullError(Exception):
+    """排队任务已满"""
+
+
+def _limit_resources(pid, cpu_limit, memory_limit):
+    """
+    进程启动后用prlimit设置资源限制（仅Linux）
+    不使用preexec_fn：在多线程的服务进程中fork后执行Python代码可能死锁
+    """
+    if not (cpu_limit or memory_limit):
+        return
+    if resource is None or not hasattr(resource, 'prlimit'):
+        print(f"当前平台不支持资源限制，进程 {pid} 将不受限制运行")
+        return
+    try:
+        if cpu_limit:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (int(cpu_limit), int(cpu_limit) + 1))
+        if memory_limit:
+            resource.prlimit(pid, resource.RLIMIT_AS, (int(memory_limit), int(memory_limit)))
+    except ProcessLookupError:
+        # 进程已经退出
+        pass
+
+
+def _round_limits(cpu_limit, memory_limit):
+    """资源限制向上取整：setrlimit只接受整数，CPU时间截断为0会使脚本立即被结束"""
+    return (math.ceil(cpu_limit) if cpu_limit else None,
+            math.ceil(memory_limit) if memory_limit else None)
+
+
+def _signal_error(returncode, cpu_limit):
+    """进程被信号结束时的错误信息"""
+    try:
+        name = signal.Signals(-returncode).name
+    except ValueError:
+        name = str(-returncode)
+    if -returncode == getattr(signal, 'SIGXCPU', None):
+        return f'CPU时间超过限制（{cpu_limit}秒），进程被{name}结束'
+    if cpu_limit and -returncode == getattr(signal, 'SIGKILL', None):
+        return f'进程被{name}结束（可能超过CPU时间限制{cpu_limit}秒或内存不足）'
+    return f'进程被信号{name}结束'
+
+
+def runner_settings(config):
+    """从监控配置中取出script_runner项的设置"""
+    settings = config.get('script_runner') or {}
+    return {key: settings[key] for key in ('max_concurrent', 'max_queue', 'cpu_limit', 'memory_limit')
+            if key in settings}
+
+
+def _dedupe_key(script_path, cpu_limit, memory_limit):
+    """相同脚本、相同资源限制的运行视为同一次运行"""
+    return (os.path.realpath(script_path), cpu_limit, memory_limit)
+
+
+class ScriptJob:
+    """一次脚本运行任务"""
+
+    def __init__(self, job_id, script_path, log_dir, priority=0, cpu_limit=None, memory_limit=None):
+        self.job_id = job_id
+        self.script_path = script_path
+        self.priority = priority
+        self.seq = 0
+        self.cpu_limit = cpu_limit         # CPU时间上限（秒）
+        self.memory_limit = memory_limit   # 地址空间上限（字节）
+        self.process = None
+        self.mode = None             # cold: 新启动解释器 / warm: 由预热进程池fork
+        self.spawn_latency = None    # 创建进程耗时（秒），不含解释器启动和导入，只反映fork/exec的开销
+        self.elapsed = None          # 从开始启动到进程退出的总耗时（秒），普通和预热启动按此对比
+        self.status = 'queued'   # queued / running / finished / failed / cancelled
+        self.cancel_requested = False
+        self.returncode = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        script_name = os.path.splitext(os.path.basename(script_path))[0]
+        self.log_file_path = os.path.join(log_dir, f"{script_name}_{job_id}.log")
+        self.logger = ProcessLogger(None, self.log_file_path)
+
+    @property
+    def finished(self):
+        return self.status in ('finished', 'failed', 'cancelled')
+
+    @property
+    def dedupe_key(self):
+        return _dedupe_key(self.script_path, self.cpu_limit, self.memory_limit)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'script_path': self.script_path,
+            'pid': self.logger.pid,
+            'status': self.status,
+            'priority': self.priority,
+            'cpu_limit': self.cpu_limit,
+            'memory_limit': self.memory_limit,
+            'mode': self.mode,
+            'spawn_latency': self.spawn_latency,
+            'elapsed': self.elapsed,
+            'returncode': self.returncode,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'log_file': self.log_file_path,
+            'lines': self.logger.line_count
+        }
+
+
+class ScriptSupervisor:
+    """
+    脚本任务管理器：任务先进入优先级队列（同优先级先进先出），
+    同时运行的进程数不超过max_concurrent，相同脚本正在排队或运行时直接复用该任务
+    """
+
+    def __init__(self, log_dir='script_logs', max_concurrent=DEFAULT_MAX_CONCURRENT, max_queue=DEFAULT_MAX_QUEUE,
+                 cpu_limit=None, memory_limit=None):
+        self.log_dir = log_dir
+        self.jobs = OrderedDict()   # job_id -> ScriptJob
+        self.lock = threading.Lock()
+        self.queue = []             # (-priority, 序号, ScriptJob) 堆
+        self.counter = itertools.count()
+        self.running = 0
+        self.active = {}            # dedupe_key -> 排队或运行中的ScriptJob
+        self.warm_pool = None       # 预热解释器池，配置了warm_runner时设置
+        self.latency = OrderedDict()   # 脚本 -> {'cold'/'warm': deque[(创建进程耗时, 总耗时)]}
+        self.configure(max_concurrent, max_queue, cpu_limit, memory_limit)
+
+    def configure(self, max_concurrent=DEFAULT_MAX_CONCURRENT, max_queue=DEFAULT_MAX_QUEUE,
+                  cpu_limit=None, memory_limit=None):
+        """更新并发数、队列长度和默认资源限制，调大并发时立即启动排队的任务"""
+        with self.lock:
+            self.max_concurrent = max(int(max_concurrent or 1), 1)
+            self.max_queue = max(int(max_queue or 0), 0)
+            self.cpu_limit, self.memory_limit = _round_limits(cpu_limit, memory_limit)
+        self._dispatch()
+
+    def submit(self, script_path, priority=0, cpu_limit=None, memory_limit=None, dedupe=True):
+        """
+        提交脚本任务并立即返回 (任务, 是否复用了已有任务)
+        资源限制未指定时使用默认值，队列已满时抛出QueueFullError
+        """
+        with self.lock:
+            cpu_limit, memory_limit = _round_limits(cpu_limit or self.cpu_limit, memory_limit or self.memory_limit)
+            existing = self.active.get(_dedupe_key(script_path, cpu_limit, memory_limit))
+            if dedupe and existing is not None:
+                return existing, True
+            if self.running >= self.max_concurrent and self._queued_count() >= self.max_queue:
+                raise QueueFullError(f'排队任务已达上限({self.max_queue})')
+            job = ScriptJob(uuid.uuid4().hex[:12], script_path, self.log_dir, priority, cpu_limit, memory_limit)
+            job.seq = next(self.counter)
+            self.jobs[job.job_id] = job
+            if existing is None:
+                self.active[job.dedupe_key] = job
+            heapq.heappush(self.queue, (-priority, job.seq, job))
+            self._prune()
+        self._dispatch()
+        return job, False
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接移出队列，运行中的先SIGTERM，超时后SIGKILL；返回任务"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job.cancel_requested = True
+            logger = None
+            if job.status == 'queued':
+                # 留在堆中，出队时跳过
+                logger = self._finish(job, 'cancelled')
+            process = job.process
+        if logger is not None:
+            logger.finish()
+            return job
+        if process is not None:
+            process.terminate()
+            timer = threading.Timer(CANCEL_GRACE_PERIOD, self._kill, args=(process,))
+            timer.daemon = True
+            timer.start()
+        return job
+
+    @staticmethod
+    def _kill(process):
+        if process.poll() is None:
+            process.kill()
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def running_jobs(self):
+        """运行中的任务，返回 [(job_id, pid, script_path)]"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [(job.job_id, job.process.pid, job.script_path) for job in jobs
+                if job.status == 'running' and job.process is not None]
+
+    def queue_position(self, job):
+        """排队任务前面还有几个任务，不在排队时返回None"""
+        with self.lock:
+            if job.status != 'queued':
+                return None
+            order = (-job.priority, job.seq)
+            return sum(1 for priority, seq, other in self.queue
+                       if other.status == 'queued' and (priority, seq) < order)
+
+    def status(self):
+        """队列和并发状态"""
+        with self.lock:
+            queued = [job for _, _, job in sorted(self.queue, key=lambda item: item[:2])
+                      if job.status == 'queued']
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'cpu_limit': self.cpu_limit,
+                'memory_limit': self.memory_limit,
+                'running': self.running,
+                'queued': len(queued),
+                'queue': [job.to_dict() for job in queued]
+            }
+
+    def list_loggers(self):
+        with self.lock:
+            return [job.logger for job in self.jobs.values()]
+
+    def _queued_count(self):
+        return sum(1 for _, _, job in self.queue if job.status == 'queued')
+
+    def _dispatch(self):
+        """在并发上限内按优先级启动排队的任务"""
+        while True:
+            with self.lock:
+                if self.running >= self.max_concurrent:
+                    return
+                job = None
+                while self.queue:
+                    _, _, candidate = heapq.heappop(self.queue)
+                    if candidate.status == 'queued':
+                        job = candidate
+                        break
+                if job is None:
+                    return
+                job.status = 'running'
+                self.running += 1
+            self._start(job)
+
+    def _finish(self, job, status, error=None):
+        """
+        记录任务结束（调用方需持有锁），返回任务的日志
+        调用方释放锁后再调用logger.finish()，刷盘和写索引不占用队列锁
+        """
+        job.status = status
+        if error is not None:
+            job.error = error
+        job.finished_at = time.time()
+        if self.active.get(job.dedupe_key) is job:
+            del self.active[job.dedupe_key]
+        return job.logger
+
+    def _start(self, job):
+        launch_started = time.monotonic()
+        try:
+            process = None
+            if self.warm_pool is not None and self.warm_pool.matches(job.script_path):
+                # 没有空闲的预热进程时按普通方式启动
+                process = self.warm_pool.spawn(job.script_path, job.cpu_limit, job.memory_limit)
+            job.mode = 'cold' if process is None else 'warm'
+            if process is None:
+                # -u 关闭输出缓冲，使输出能实时读取
+                process = subprocess.Popen(
+                    [sys.executable, '-u', job.script_path],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+                _limit_resources(process.pid, job.cpu_limit, job.memory_limit)
+            job.process = process
+        except Exception as e:
+            with self.lock:
+                self.running -= 1
+                logger = self._finish(job, 'failed', f'执行脚本时出错: {str(e)}')
+            logger.finish()
+            self._dispatch()
+            return
+
+        job.spawn_latency = time.monotonic() - launch_started
+        job.logger.pid = job.process.pid
+        job.started_at = time.time()
+        readers = capture_process_output(job.process, job.logger)
+
+        waiter = threading.Thread(target=self._wait, args=(job, readers, launch_started),
+                                  name=f'script-job-{job.job_id}')
+        waiter.daemon = True
+        waiter.start()
+        if job.cancel_requested:
+            # 启动期间收到取消请求
+            self.cancel(job.job_id)
+
+    def _wait(self, job, readers, launch_started):
+        """等待进程退出并读完全部输出，然后启动下一个排队的任务"""
+        job.returncode = job.process.wait()
+        for reader in readers:
+            reader.join()
+        job.elapsed = time.monotonic() - launch_started
+        with self.lock:
+            self.running -= 1
+            if job.cancel_requested:
+                logger = self._finish(job, 'cancelled')
+            elif job.returncode is not None and job.returncode < 0:
+                # 被信号结束（包括超过资源限制）
+                logger = self._finish(job, 'failed', _signal_error(job.returncode, job.cpu_limit))
+            else:
+                logger = self._finish(job, 'finished')
+                self._record_latency(job)
+        logger.finish()
+        self._dispatch()
+
+    def _record_latency(self, job):
+        """记录创建进程耗时和总耗时，用于对比普通启动和预热启动（调用方需持有锁）"""
+        script = os.path.realpath(job.script_path)
+        history = self.latency.get(script)
+        if history is None:
+            history = self.latency[script] = {'cold': deque(maxlen=LATENCY_HISTORY),
+                                              'warm': deque(maxlen=LATENCY_HISTORY)}
+        self.latency.move_to_end(script)
+        history[job.mode].append((job.spawn_latency, job.elapsed))
+        while len(self.latency) > MAX_LATENCY_SCRIPTS:
+            self.latency.popitem(last=False)
+
+    def latency_stats(self):
+        """
+        各脚本普通启动和预热启动的运行次数、平均创建进程耗时、平均及中位总耗时
+        解释器启动和导入的开销只体现在总耗时中，两种方式都有记录时给出平均总耗时之差
+        """
+        with self.lock:
+            items = [(script, {mode: list(runs) for mode, runs in history.items()})
+                     for script, history in self.latency.items()]
+        result = []
+        for script, history in items:
+            entry = {'script': script}
+            for mode, runs in history.items():
+                elapsed = sorted(total for _, total in runs)
+                entry[mode] = {
+                    'runs': len(runs),
+                    'spawn_mean': sum(spawn for spawn, _ in runs) / len(runs) if runs else None,
+                    'elapsed_mean': sum(elapsed) / len(elapsed) if elapsed else None,
+                    'elapsed_p50': elapsed[(len(elapsed) - 1) // 2] if elapsed else None
+                }
+            if entry['cold']['runs'] and entry['warm']['runs']:
+                entry['saved'] = entry['cold']['elapsed_mean'] - entry['warm']['elapsed_mean']
+            result.append(entry)
+        return result
+
+    def _prune(self):
+        """清理过多的已结束任务（调用方需持有锁）"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
@@ -2,154 +2,835 @@
 
 import paramiko
 import threading
+import hmac
+import hashlib
+import secrets
 import time
 import os
+import json
+import codecs
+import socket
+import selectors
+import uuid
+import weakref
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Shell每次读取的最大字节数
+SHELL_READ_SIZE = 64 * 1024
+# Shell通道的SSH流控窗口，服务端为每个Shell缓冲的数据不会超过该值
+SHELL_WINDOW_SIZE = 256 * 1024
+# 合并输出的等待时间（秒），避免大量小帧压垮浏览器
+SHELL_FRAME_INTERVAL = 0.02
+# 每个Shell会话保留的输出字节数
+SHELL_BUFFER_SIZE = 1024 * 1024
+# Shell会话空闲超时（秒），超时后自动关闭
+SHELL_IDLE_TIMEOUT = 600
+# SSH传输层保活间隔（秒），连接断开时传输层会及时变为非活动状态
+KEEPALIVE_INTERVAL = 30
+# 后台健康检查间隔（秒），检查结果在该时间内有效
+HEALTH_CHECK_INTERVAL = 60
+# 单次健康检查超时（秒）
+HEALTH_CHECK_TIMEOUT = 5
+# 健康检查并发数
+HEALTH_CHECK_WORKERS = 16
+# 建立SSH连接超时（秒）
+CONNECT_TIMEOUT = 10
+# 每条SSH传输上同时打开的通道数上限（OpenSSH默认MaxSessions为10）
+MAX_CHANNELS_PER_TRANSPORT = 10
+# 断线重连的初始退避时间和最大退避时间（秒）
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+# 执行命令时每个输出流最多保留的字节数
+COMMAND_OUTPUT_LIMIT = 1024 * 1024
+
+class ChannelLimitError(Exception):
+    """传输上的通道数已达上限"""
+
+
+class SSHPoolEntry:
+    """连接池中的一条SSH传输，同一主机的多个连接ID共享，所有通道在其上复用"""
+
+    def __init__(self, key, connection_data):
+        self.key = key
+        self.connection_data = connection_data
+        self.client = None
+        self.conn_ids = set()
+        self.channels = weakref.WeakSet()   # 通过连接池打开的通道
+        self.failures = 0       # 连续重连失败次数
+        self.next_retry = 0     # 下次允许重连的时间（monotonic）
+        self.received = None    # 上次记录时传输层已收到的数据包序号
+        self.lock = threading.Lock()
+
+    @property
+    def address(self):
+        """(host, port, username)"""
+        return self.key[:3]
+
+    def is_active(self):
+        transport = self.client.get_transport() if self.client is not None else None
+        return transport is not None and transport.is_active()
+
+    def open_channels(self):
+        return [channel for channel in list(self.channels) if not channel.closed]
+
+    def received_packets(self):
+        """传输层收到的数据包序号，每收到一个包（含保活应答、通道数据）加一；取不到时返回None"""
+        transport = self.client.get_transport() if self.client is not None else None
+        # paramiko没有公开接收计数，从Packetizer的入站序号读取
+        packetizer = getattr(transport, 'packetizer', None)
+        return getattr(packetizer, '_Packetizer__sequence_number_in', None)
+
+
+# 计算认证信息摘要的进程内密钥，连接池中不保存明文密码
+_AUTH_DIGEST_KEY = secrets.token_bytes(32)
+
+
+def _auth_digest(connection_data):
+    """认证方式、密码、密钥文件和口令的摘要"""
+    material = json.dumps([
+        connection_data.get('auth_method'),
+        connection_data.get('password', ''),
+        connection_data.get('key_file', ''),
+        connection_data.get('passphrase', '')
+    ])
+    return hmac.new(_AUTH_DIGEST_KEY, material.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _pool_key(connection_data):
+    """认证信息也是键的一部分：凭据不同时单独握手，错误的凭据不会借用已认证的传输"""
+    return (connection_data['host'], int(connection_data.get('port', 22)), connection_data['username'],
+            _auth_digest(connection_data))
+
 
 class SSHConnectionManager:
-    """SSH连接管理器"""
+    """
+    SSH连接管理器（连接池）
+    同一主机只保持一条传输，exec/shell/sftp通道在其上复用，断开后在下次使用时按指数退避重连
+    """
     
-    def __init__(self):
+    def __init__(self, max_channels=MAX_CHANNELS_PER_TRANSPORT):
         self.connections = {}  # 存储活动的SSH连接
         self.shells = {}       # 存储活动的SSH Shell会话
+        self.last_seen = {}    # 连接最后一次确认可用的时间
+        self.pool = {}         # (host, port, username, 认证信息摘要) -> SSHPoolEntry
+        self.conn_entries = {} # conn_id -> SSHPoolEntry
+        self.max_channels = max_channels
+        self.stats = {
+            'hits': 0,                 # 复用已有传输的次数
+            'handshakes': 0,           # 新建传输（完整密钥交换）的次数
+            'reconnects': 0,           # 断线后重连成功的次数
+            'reconnect_failures': 0,   # 重连失败的次数
+            'channel_rejections': 0    # 因通道数达到上限被拒绝的次数
+        }
+        self.lock = threading.Lock()
+        self.health_checker = SSHHealthChecker(self)
         
     def connect(self, conn_id, connection_data):
-        """建立SSH连接"""
+        """建立SSH连接，同一主机已有可用传输时直接复用"""
+        entry = None
         try:
-            # 创建SSH客户端
-            ssh_client = paramiko.SSHClient()
-            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            # 获取连接参数
-            host = connection_data['host']
-            port = int(connection_data.get('port', 22))
-            username = connection_data['username']
-            
-            # 根据认证方式连接
-            if connection_data.get('auth_method') == 'key_file' and 'key_file' in connection_data:
-                # 使用密钥文件认证
-                key_file = connection_data['key_file']
-                if os.path.exists(key_file):
-                    private_key = paramiko.RSAKey.from_private_key_file(key_file)
-                    ssh_client.connect(host, port=port, username=username, pkey=private_key)
+            key = _pool_key(connection_data)
+            with self.lock:
+                old_entry = self.conn_entries.get(conn_id)
+                entry = self.pool.get(key)
+                if entry is None:
+                    entry = SSHPoolEntry(key, connection_data)
+                    self.pool[key] = entry
+            if old_entry is not None and old_entry is not entry:
+                # 连接ID改为指向其他主机
+                self.disconnect(conn_id)
+
+            with entry.lock:
+                if entry.is_active():
+                    self._count('hits')
                 else:
-                    raise Exception(f"密钥文件不存在: {key_file}")
-            else:
-                # 使用密码认证
-                password = connection_data.get('password', '')
-                ssh_client.connect(host, port=port, username=username, password=password)
-            
-            # 存储连接
-            self.connections[conn_id] = ssh_client
+                    entry.connection_data = connection_data
+                    self._handshake(entry)
+
+            with self.lock:
+                entry.conn_ids.add(conn_id)
+                self.conn_entries[conn_id] = entry
+                self.connections[conn_id] = entry.client
+            self.last_seen[conn_id] = time.time()
+            self.health_checker.start()
             
             return True
         except Exception as e:
             print(f"SSH连接失败: {str(e)}")
+            if entry is not None:
+                with self.lock:
+                    if not entry.conn_ids and self.pool.get(entry.key) is entry:
+                        del self.pool[entry.key]
             return False
+
+    def _handshake(self, entry):
+        """为连接池条目新建SSH传输（调用方需持有entry.lock）"""
+        connection_data = entry.connection_data
+
+        # 创建SSH客户端
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        
+        # 获取连接参数
+        host, port, username = entry.address
+        
+        # 根据认证方式连接
+        if connection_data.get('auth_method') == 'key_file' and 'key_file' in connection_data:
+            # 使用密钥文件认证
+            key_file = connection_data['key_file']
+            if os.path.exists(key_file):
+                private_key = paramiko.RSAKey.from_private_key_file(key_file)
+                ssh_client.connect(host, port=port, username=username, pkey=private_key,
+                                   timeout=CONNECT_TIMEOUT, banner_timeout=CONNECT_TIMEOUT,
+                                   auth_timeout=CONNECT_TIMEOUT)
+            else:
+                raise Exception(f"密钥文件不存在: {key_file}")
+        else:
+            # 使用密码认证
+            password = connection_data.get('password', '')
+            ssh_client.connect(host, port=port, username=username, password=password,
+                               timeout=CONNECT_TIMEOUT, banner_timeout=CONNECT_TIMEOUT,
+                               auth_timeout=CONNECT_TIMEOUT)
+        
+        # 开启传输层保活
+        ssh_client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+
+        old_client = entry.client
+        entry.client = ssh_client
+        entry.received = None
+        if old_client is not None:
+            try:
+                old_client.close()
+            except Exception:
+                pass
+        self._count('handshakes')
+
+        with self.lock:
+            for conn_id in entry.conn_ids:
+                self.connections[conn_id] = ssh_client
+        for conn_id in entry.conn_ids:
+            self.health_checker.forget(conn_id)
+    
+    def _reconnect(self, entry):
+        """重连断开的传输，连续失败时按指数退避延后下次尝试"""
+        with entry.lock:
+            if not self._needs_reconnect(entry):
+                # 其他线程已完成重连
+                return
+            now = time.monotonic()
+            if now < entry.next_retry:
+                return
+            try:
+                self._handshake(entry)
+                entry.failures = 0
+                entry.next_retry = 0
+                self._count('reconnects')
+            except Exception as e:
+                entry.failures += 1
+                delay = min(RECONNECT_BASE_DELAY * 2 ** (entry.failures - 1), RECONNECT_MAX_DELAY)
+                entry.next_retry = now + delay
+                self._count('reconnect_failures')
+                print(f"SSH重连失败（{delay:.0f}秒后重试）: {str(e)}")
+
+    def _needs_reconnect(self, entry):
+        # 只在传输层已断开时重连；健康检查失败不关闭仍活动的传输，否则会中断其上所有通道
+        return not entry.is_active()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
     
     def disconnect(self, conn_id):
-        """断开SSH连接"""
-        if conn_id in self.connections:
+        """断开SSH连接，共享的传输在最后一个连接ID断开时关闭"""
+        with self.lock:
+            entry = self.conn_entries.pop(conn_id, None)
+            self.connections.pop(conn_id, None)
+            close_entry = entry is not None and entry.conn_ids <= {conn_id}
+            if entry is not None:
+                entry.conn_ids.discard(conn_id)
+            if close_entry and self.pool.get(entry.key) is entry:
+                del self.pool[entry.key]
+        self.last_seen.pop(conn_id, None)
+        self.health_checker.forget(conn_id)
+
+        if close_entry and entry.client is not None:
             try:
-                ssh_client = self.connections[conn_id]
-                ssh_client.close()
+                entry.client.close()
             except Exception as e:
                 print(f"关闭SSH连接时出错: {str(e)}")
-            finally:
-                # 从活动连接中移除
-                if conn_id in self.connections:
-                    del self.connections[conn_id]
     
+    def get_client(self, conn_id):
+        """获取指定连接的SSH客户端，传输已断开时尝试重连，不可用时返回None"""
+        entry = self.conn_entries.get(conn_id)
+        if entry is None:
+            return None
+        if self._needs_reconnect(entry):
+            self._reconnect(entry)
+        return entry.client if entry.is_active() else None
+
+    def open_session(self, conn_id, **kwargs):
+        """在连接池的传输上打开一个会话通道，每条传输的通道数有上限"""
+        ssh_client = self.get_client(conn_id)
+        entry = self.conn_entries.get(conn_id)
+        if ssh_client is None or entry is None:
+            raise Exception("SSH连接不存在或已断开")
+
+        with entry.lock:
+            if len(entry.open_channels()) >= self.max_channels:
+                self._count('channel_rejections')
+                raise ChannelLimitError(f"SSH连接的通道数已达上限（{self.max_channels}）")
+            channel = ssh_client.get_transport().open_session(**kwargs)
+            entry.channels.add(channel)
+        return channel
+
+    def open_sftp(self, conn_id):
+        """在连接池的传输上打开SFTP会话"""
+        channel = self.open_session(conn_id)
+        channel.invoke_subsystem('sftp')
+        return paramiko.SFTPClient(channel)
+
+    def pool_entries(self):
+        """返回 [(连接池条目, 连接ID列表)]"""
+        with self.lock:
+            return [(entry, sorted(entry.conn_ids)) for entry in self.pool.values()]
+
+    def get_pool_stats(self):
+        """连接池统计"""
+        now = time.monotonic()
+        transports = []
+        for entry, conn_ids in self.pool_entries():
+            host, port, username = entry.address
+            transports.append({
+                'host': host,
+                'port': port,
+                'username': username,
+                'conn_ids': conn_ids,
+                'active': entry.is_active(),
+                'channels': len(entry.open_channels()),
+                'failures': entry.failures,
+                'retry_in': max(entry.next_retry - now, 0)
+            })
+        with self.lock:
+            stats = dict(self.stats)
+        return {'stats': stats, 'max_channels': self.max_channels, 'transports': transports}
+
     def is_connected(self, conn_id):
-        """检查连接是否仍然有效"""
-        if conn_id not in self.connections:
-            return False
-            
-        try:
-            ssh_client = self.connections[conn_id]
-            ssh_client.exec_command('echo test', timeout=5)
-            return True
-        except Exception as e:
-            # 连接已断开，清理资源
-            self.disconnect(conn_id)
+        """
+        检查连接是否仍然有效
+        只检查本地传输层状态和后台健康检查的缓存结果，不会访问远端
+        """
+        entry = self.conn_entries.get(conn_id)
+        if entry is None:
             return False
+        return entry.is_active() and not self.health_checker.is_dead(conn_id)
     
+    def execute_command(self, conn_id, command, timeout=30):
+        """
+        在指定连接上执行命令，超时抛出TimeoutError
+        返回 {'exit_status', 'stdout', 'stderr', 'truncated'}
+        """
+        deadline = time.monotonic() + timeout
+        channel = self.open_session(conn_id, timeout=timeout)
+        try:
+            channel.exec_command(command)
+            stdout, stderr = bytearray(), bytearray()
+            truncated = False
+            selector = selectors.DefaultSelector()
+            selector.register(channel, selectors.EVENT_READ)
+            try:
+                while True:
+                    progressed = False
+                    if channel.recv_ready():
+                        data = channel.recv(SHELL_READ_SIZE)
+                        truncated |= _append_limited(stdout, data)
+                        progressed = True
+                    if channel.recv_stderr_ready():
+                        data = channel.recv_stderr(SHELL_READ_SIZE)
+                        truncated |= _append_limited(stderr, data)
+                        progressed = True
+                    if progressed:
+                        continue
+                    if channel.exit_status_ready():
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"命令执行超时（超过{timeout}秒）")
+                    # stdout可读或通道结束时立即唤醒，stderr数据最多延迟50毫秒
+                    selector.select(timeout=min(remaining, 0.05))
+            finally:
+                selector.close()
+
+            # 两次检查之间到达的输出仍在缓冲区中，收到退出状态后读到EOF为止
+            channel.settimeout(max(deadline - time.monotonic(), 0.1))
+            try:
+                for recv, buffer in ((channel.recv, stdout), (channel.recv_stderr, stderr)):
+                    while True:
+                        data = recv(SHELL_READ_SIZE)
+                        if not data:
+                            break
+                        truncated |= _append_limited(buffer, data)
+            except socket.timeout:
+                raise TimeoutError(f"命令执行超时（超过{timeout}秒）")
+
+            self.last_seen[conn_id] = time.time()
+            return {
+                'exit_status': channel.recv_exit_status(),
+                'stdout': stdout.decode('utf-8', errors='replace'),
+                'stderr': stderr.decode('utf-8', errors='replace'),
+                'truncated': truncated
+            }
+        finally:
+            channel.close()
+
+    def record_activity(self):
+        """传输层自上次记录后收到过数据时，更新其上所有连接的last_seen"""
+        now = time.time()
+        for entry, conn_ids in self.pool_entries():
+            if not entry.is_active():
+                continue
+            received = entry.received_packets()
+            if received is not None and received != entry.received:
+                if entry.received is not None:
+                    for conn_id in conn_ids:
+                        self.last_seen[conn_id] = now
+                entry.received = received
+
     def get_active_connections(self):
-        """获取活动连接列表"""
-        active_connections = []
-        disconnected_connections = []
-        
-        for conn_id in self.connections:
-            if self.is_connected(conn_id):
-                active_connections.append(conn_id)
-            else:
-                disconnected_connections.append(conn_id)
-        
-        # 清理已断开的连接
-        for conn_id in disconnected_connections:
-            if conn_id in self.connections:
-                del self.connections[conn_id]
-        
-        return active_connections
+        """获取活动连接列表（已断开的连接保留在连接池中，下次使用时自动重连）"""
+        return [conn_id for conn_id in list(self.connections) if self.is_connected(conn_id)]
 
-class SSHShellHandler:
-    """SSH Shell处理器"""
-    
-    def __init__(self, ssh_manager):
+def _append_limited(buffer, data, limit=COMMAND_OUTPUT_LIMIT):
+    """追加数据但不超过上限，返回是否有数据被丢弃"""
+    room = limit - len(buffer)
+    buffer += data[:max(room, 0)]
+    return len(data) > room
+
+class SSHHealthChecker:
+    """后台SSH健康检查：定期并行探测所有连接，结果带有效期缓存"""
+
+    def __init__(self, ssh_manager, interval=HEALTH_CHECK_INTERVAL, timeout=HEALTH_CHECK_TIMEOUT):
         self.ssh_manager = ssh_manager
-        self.shells = {}
-    
-    def create_shell(self, conn_id):
-        """为指定连接创建Shell会话"""
-        if conn_id not in self.ssh_manager.connections:
+        self.interval = interval
+        self.timeout = timeout
+        self.results = {}   # conn_id -> 最近一次检查结果
+        self.in_flight = set()  # 正在探测的连接池条目key，上次未完成时跳过
+        self.lock = threading.Lock()
+        self._executor = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动检查线程（重复调用无副作用）"""
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=HEALTH_CHECK_WORKERS,
+                                                thread_name_prefix='ssh-health')
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='ssh-health-checker')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """停止检查线程，正在进行的探测完成后关闭线程池"""
+        self._stop_event.set()
+        with self.lock:
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+        if thread is not None:
+            thread.join(timeout=self.timeout * 2 + 2)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def get_results(self):
+        with self.lock:
+            return dict(self.results)
+
+    def is_dead(self, conn_id):
+        """有效期内的检查结果为失败时返回True（超时或通道已满时alive为None，不算失败）"""
+        with self.lock:
+            result = self.results.get(conn_id)
+        if result is None or result['alive'] is not False:
             return False
-            
+        return time.time() - result['checked_at'] <= self.interval * 2
+
+    def forget(self, conn_id):
+        with self.lock:
+            self.results.pop(conn_id, None)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                print(f"SSH健康检查失败: {str(e)}")
+
+    def check_all(self):
+        """
+        并行探测所有连接，共享传输的连接只探测一次
+        每个探测从开始执行起计算超时，排队中的探测不会被记为失败，完成时各自写入结果
+        """
+        self.ssh_manager.record_activity()
+        futures = []
+        for entry, conn_ids in self.ssh_manager.pool_entries():
+            with self.lock:
+                if not conn_ids or entry.key in self.in_flight:
+                    continue
+                self.in_flight.add(entry.key)
+            futures.append(self._executor.submit(self._check, entry.key, conn_ids))
+        done, _ = wait(futures, timeout=self.timeout * 2 + 1)
+
+        results = {}
+        for future in done:
+            results.update(future.result())
+        return results
+
+    def _check(self, key, conn_ids):
         try:
-            ssh_client = self.ssh_manager.connections[conn_id]
-            shell = ssh_client.invoke_shell()
-            shell.settimeout(0)  # 非阻塞模式
-            
-            self.shells[conn_id] = shell
-            return True
-        except Exception as e:
-            print(f"创建Shell会话失败: {str(e)}")
-            return False
-    
-    def send_command(self, conn_id, command):
-        """向Shell会话发送命令"""
-        if conn_id not in self.shells:
-            return False
-            
+            result = self._probe(conn_ids[0])
+        finally:
+            with self.lock:
+                self.in_flight.discard(key)
+        result['checked_at'] = time.time()
+        results = {conn_id: dict(result) for conn_id in conn_ids}
+        if result['alive']:
+            for conn_id in conn_ids:
+                self.ssh_manager.last_seen[conn_id] = result['checked_at']
+        with self.lock:
+            self.results.update(results)
+        return results
+
+    def _probe(self, conn_id):
+        """在远端执行一条简单命令，确认连接真正可用（传输已断开时会触发重连）"""
+        started = time.monotonic()
         try:
-            shell = self.shells[conn_id]
-            shell.send(command)
-            return True
+            channel = self.ssh_manager.open_session(conn_id, timeout=self.timeout)
+            try:
+                # 打开通道和等待响应共用同一个超时
+                channel.settimeout(max(self.timeout - (time.monotonic() - started), 0.1))
+                channel.exec_command('echo test')
+                if not channel.recv(64):
+                    raise Exception("未收到响应")
+            finally:
+                channel.close()
+            return {'alive': True, 'latency': time.monotonic() - started, 'error': None}
+        except ChannelLimitError as e:
+            # 通道已满说明传输正忙，不是断开
+            return {'alive': None, 'latency': None, 'error': str(e)}
+        except socket.timeout:
+            # 响应慢不代表传输已断开，由传输层保活判断
+            return {'alive': None, 'latency': None, 'error': '检查超时'}
+        except paramiko.SSHException as e:
+            # 打开通道超时（paramiko抛出SSHException）同样按超时处理
+            if str(e).startswith('Timeout'):
+                return {'alive': None, 'latency': None, 'error': '检查超时'}
+            return {'alive': False, 'latency': None, 'error': str(e)}
         except Exception as e:
-            print(f"发送命令失败: {str(e)}")
+            return {'alive': False, 'latency': None, 'error': str(e)}
+
+
+class ShellSession:
+    """Shell会话：通道输出写入定长缓冲区，按字节序号读取"""
+
+    def __init__(self, session_id, conn_id, channel, buffer_size=SHELL_BUFFER_SIZE):
+        self.session_id = session_id
+        self.conn_id = conn_id
+        self.channel = channel
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.start_seq = 0   # 缓冲区第一个字节的序号
+        self.created_at = time.time()
+        self.last_active = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def end_seq(self):
+        return self.start_seq + len(self.buffer)
+
+    def append(self, data):
+        """追加输出，超过缓冲区大小时丢弃最旧的数据"""
+        with self.lock:
+            self.buffer += data
+            overflow = len(self.buffer) - self.buffer_size
+            if overflow > 0:
+                del self.buffer[:overflow]
+                self.start_seq += overflow
+
+    def read(self, since=None):
+        """
+        读取序号since之后的输出，返回 (文本, 下次读取的序号, 是否有数据已被丢弃)
+        since为空时从缓冲区中最早的数据开始读取
+        """
+        with self.lock:
+            self.last_active = time.monotonic()
+            if since is None or since < self.start_seq:
+                truncated = since is not None
+                since = self.start_seq
+            else:
+                truncated = False
+            since = min(since, self.end_seq)
+            data = bytes(self.buffer[since - self.start_seq:])
+        # 不在多字节字符中间截断，剩余字节留到下次读取
+        length = _utf8_boundary(data)
+        return data[:length].decode('utf-8', errors='replace'), since + length, truncated
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def info(self):
+        return {
+            'session_id': self.session_id,
+            'conn_id': self.conn_id,
+            'created_at': self.created_at,
+            'idle': time.monotonic() - self.last_active,
+            'next': self.end_seq,
+            'closed': self.channel.closed
+        }
+
+
+def _utf8_boundary(data):
+    """返回data中完整UTF-8字符的字节长度"""
+    # 从末尾向前最多检查3个字节，找到最后一个字符的起始字节
+    for i in range(1, min(4, len(data)) + 1):
+        byte = data[-i]
+        if byte & 0xC0 != 0x80:
+            if byte >= 0xF0:
+                needed = 4
+            elif byte >= 0xE0:
+                needed = 3
+            elif byte >= 0xC0:
+                needed = 2
+            else:
+                needed = 1
+            return len(data) if needed <= i else len(data) - i
+    return len(data)
+
+
+class SSHShellHandler:
+    """
+    SSH Shell会话注册表（进程级）
+    所有会话的输出由一个后台线程通过selector统一读取，空闲超时的会话自动关闭
+    """
+
+    def __init__(self, ssh_manager, idle_timeout=SHELL_IDLE_TIMEOUT):
+        self.ssh_manager = ssh_manager
+        self.idle_timeout = idle_timeout
+        self.shells = {}   # session_id -> ShellSession
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self._pending = []   # 等待注册到selector的会话
+        self._closing = []   # 等待关闭的会话，统一由读取线程注销后关闭
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = None
+
+    def create_shell(self, conn_id, cols=80, rows=24):
+        """为指定连接创建Shell会话，返回会话ID"""
+        channel = self.ssh_manager.open_session(conn_id, window_size=SHELL_WINDOW_SIZE)
+        channel.get_pty(term='xterm', width=cols, height=rows)
+        channel.invoke_shell()
+
+        session = ShellSession(uuid.uuid4().hex, conn_id, channel)
+        with self.lock:
+            self.shells[session.session_id] = session
+            self._pending.append(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ssh-shell-reader')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup()
+        return session.session_id
+
+    def get_session(self, session_id):
+        with self.lock:
+            return self.shells.get(session_id)
+
+    def send_command(self, session_id, command):
+        """向Shell会话发送输入"""
+        session = self.get_session(session_id)
+        if session is None:
             return False
-    
-    def read_output(self, conn_id):
-        """从Shell会话读取输出"""
-        if conn_id not in self.shells:
-            return None
-            
-        try:
-            shell = self.shells[conn_id]
-            if shell.recv_ready():
-                output = shell.recv(1024).decode('utf-8')
-                return output
-            return None
-        except Exception as e:
-            print(f"读取输出失败: {str(e)}")
+        session.touch()
+        session.channel.sendall(command.encode('utf-8'))
+        return True
+
+    def read_output(self, session_id, since=None):
+        """从Shell会话读取since之后的输出"""
+        session = self.get_session(session_id)
+        if session is None:
             return None
-    
-    def close_shell(self, conn_id):
+        return session.read(since)
+
+    def resize_shell(self, session_id, cols, rows):
+        session = self.get_session(session_id)
+        if session is None:
+            return False
+        session.touch()
+        session.channel.resize_pty(width=cols, height=rows)
+        return True
+
+    def list_shells(self):
+        with self.lock:
+            sessions = list(self.shells.values())
+        return [session.info() for session in sessions]
+
+    def close_shell(self, session_id):
         """关闭Shell会话"""
-        if conn_id in self.shells:
+        with self.lock:
+            session = self.shells.pop(session_id, None)
+            if session is None:
+                return False
+            # 通道关闭时会关闭其文件描述符，必须先从selector中注销，因此交给读取线程处理
+            self._closing.append(session)
+        self._wakeup()
+        return True
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'x')
+        except OSError:
+            pass
+
+    def _run(self):
+        registered = {}   # session_id -> 注册时的文件描述符
+        last_sweep = time.monotonic()
+        while True:
+            with self.lock:
+                pending, self._pending = self._pending, []
+                closing, self._closing = self._closing, []
+            for session in pending:
+                fd = session.channel.fileno()
+                self.selector.register(fd, selectors.EVENT_READ, session)
+                registered[session.session_id] = fd
+            for session in closing:
+                fd = registered.pop(session.session_id, None)
+                if fd is not None:
+                    self.selector.unregister(fd)
+                try:
+                    session.channel.close()
+                except Exception as e:
+                    print(f"关闭Shell会话时出错: {str(e)}")
+
+            for key, _ in self.selector.select(timeout=1):
+                if key.data is None:
+                    os.read(self._wakeup_r, 4096)
+                    continue
+                session = key.data
+                try:
+                    data = session.channel.recv(SHELL_READ_SIZE)
+                except Exception:
+                    data = b''
+                if data:
+                    session.append(data)
+                elif session.session_id in registered:
+                    # 通道已结束，保留缓冲区供客户端读取剩余输出，等待空闲超时清理
+                    self.selector.unregister(registered.pop(session.session_id))
+
+            now = time.monotonic()
+            if now - last_sweep >= 1:
+                last_sweep = now
+                self._evict_idle(now)
+
+    def _evict_idle(self, now):
+        """关闭空闲超时的会话"""
+        with self.lock:
+            expired = [session_id for session_id, session in self.shells.items()
+                       if now - session.last_active > self.idle_timeout]
+        for session_id in expired:
+            self.close_shell(session_id)
+
+
+class SSHShellBridge:
+    """在SSH Shell通道和WebSocket之间双向转发数据"""
+
+    def __init__(self, ssh_manager, conn_id, ws, cols=80, rows=24):
+        self.ssh_manager = ssh_manager
+        self.conn_id = conn_id
+        self.ws = ws
+        self.cols = cols
+        self.rows = rows
+        self.channel = None
+
+    def open(self):
+        """打开带伪终端的Shell通道"""
+        # 使用较小的流控窗口：浏览器消费变慢时远端会被SSH流控暂停，服务端内存占用有上限
+        self.channel = self.ssh_manager.open_session(self.conn_id, window_size=SHELL_WINDOW_SIZE)
+        self.channel.get_pty(term='xterm', width=self.cols, height=self.rows)
+        self.channel.invoke_shell()
+
+    def run(self):
+        """转发数据直到任意一端关闭，当前线程负责输入，后台线程负责输出"""
+        output_thread = threading.Thread(target=self._pump_output, name='ssh-shell-output')
+        output_thread.daemon = True
+        output_thread.start()
+        try:
+            while not self.channel.closed:
+                message = self.ws.receive(timeout=1)
+                if message is None:
+                    continue
+                self._handle_message(message)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.channel is not None:
             try:
-                shell = self.shells[conn_id]
-                shell.close()
+                self.channel.close()
             except Exception as e:
                 print(f"关闭Shell会话时出错: {str(e)}")
-            finally:
-                del self.shells[conn_id]
\ No newline at end of file
+
+    def _handle_message(self, message):
+        """处理客户端消息：二进制或普通文本作为输入，JSON控制消息用于调整终端大小"""
+        if isinstance(message, bytes):
+            self.channel.sendall(message)
+            return
+
+        if message.startswith('{'):
+            try:
+                control = json.loads(message)
+            except ValueError:
+                control = None
+            if isinstance(control, dict) and control.get('type') == 'resize':
+                self.cols = int(control.get('cols', self.cols))
+                self.rows = int(control.get('rows', self.rows))
+                self.channel.resize_pty(width=self.cols, height=self.rows)
+                return
+            if isinstance(control, dict) and control.get('type') == 'input':
+                message = control.get('data', '')
+
+        self.channel.sendall(message.encode('utf-8'))
+
+    def _pump_output(self):
+        """读取通道输出并发送到WebSocket"""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        selector = selectors.DefaultSelector()
+        selector.register(self.channel, selectors.EVENT_READ)
+        try:
+            while True:
+                if not selector.select(timeout=1):
+                    if self.channel.closed or (self.channel.exit_status_ready() and not self.channel.recv_ready()):
+                        break
+                    continue
+
+                data = self.channel.recv(SHELL_READ_SIZE)
+                if not data:
+                    break
+                # 短暂等待以合并后续到达的数据，一帧最多SHELL_READ_SIZE字节
+                while len(data) < SHELL_READ_SIZE and selector.select(timeout=SHELL_FRAME_INTERVAL):
+                    chunk = self.channel.recv(SHELL_READ_SIZE - len(data))
+                    if not chunk:
+                        break
+                    data += chunk
+
+                # ws.send在客户端接收缓慢时会阻塞，此时不再读取通道，由SSH流控暂停远端输出
+                self.ws.send(json.dumps({'output': decoder.decode(data)}))
+        except Exception as e:
+            if not self.channel.closed:
+                print(f"转发Shell输出失败: {str(e)}")
+        finally:
+            selector.close()
+            try:
+                self.ws.close()
+            except Exception:
+                pass
@@ -0,0 +1,195 @@
+"""
+System Sampler Utility
+Collects system metrics in a background thread and keeps the latest snapshot
+"""
+
+import heapq
+import threading
+import time
+from operator import itemgetter
+import psutil
+
+# 进程排序方式对应的字段位置 (cpu_percent, memory_percent, pid, name)
+PROCESS_SORT_KEYS = {
+    'cpu': itemgetter(0),
+    'memory': itemgetter(1),
+}
+
+
+class ProcessTable:
+    """跨采样复用psutil.Process对象，使每个进程的CPU使用率为两次采样间的真实值"""
+
+    def __init__(self):
+        self.processes = {}  # pid -> psutil.Process
+
+    def sample(self, total_memory):
+        """采集所有进程，返回 (cpu_percent, memory_percent, pid, name) 列表"""
+        pids = psutil.pids()
+
+        # 清理已退出的进程
+        alive = set(pids)
+        for pid in [pid for pid in self.processes if pid not in alive]:
+            del self.processes[pid]
+
+        rows = []
+        for pid in pids:
+            proc = self.processes.get(pid)
+            try:
+                if proc is None:
+                    # 新进程首次采样只做预热，CPU使用率从下一次采样开始有效
+                    proc = psutil.Process(pid)
+                    self.processes[pid] = proc
+                with proc.oneshot():
+                    cpu_percent = proc.cpu_percent(interval=None)
+                    rss = proc.memory_info().rss
+                    name = proc.name()
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                self.processes.pop(pid, None)
+                continue
+            except psutil.AccessDenied:
+                continue
+            memory_percent = rss * 100.0 / total_memory if total_memory else 0
+            rows.append((cpu_percent, memory_percent, pid, name))
+        return rows
+
+
+def rank_processes(rows, n, sort='cpu'):
+    """取CPU或内存占用最高的n个进程"""
+    top = heapq.nlargest(n, rows, key=PROCESS_SORT_KEYS[sort])
+    return [{
+        'pid': pid,
+        'name': name,
+        'cpu_percent': cpu_percent,
+        'memory_percent': memory_percent
+    } for cpu_percent, memory_percent, pid, name in top]
+
+
+class SystemSampler:
+    """系统指标后台采样器"""
+
+    def __init__(self, interval=1.0):
+        self.interval = max(float(interval), 0.1)
+        self.snapshot = None   # 最近一次采样结果
+        self.listeners = []    # 每次采样后回调的订阅者
+        self.process_table = ProcessTable()
+        self.process_rows = []  # 最近一次采样的全部进程数据
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动采样线程（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        # 预热CPU计数器，并同步采集一次，保证接口随时有数据可返回
+        psutil.cpu_percent(interval=None)
+        self._store(self.collect())
+        self._thread = threading.Thread(target=self._run, name='system-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def subscribe(self, callback):
+        """订阅采样结果，callback(snapshot)在采样线程中调用"""
+        self.listeners.append(callback)
+
+    def stop(self):
+        """停止采样线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def get_snapshot(self):
+        """获取最近一次采样结果，附带采样时间和延迟"""
+        with self.lock:
+            snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        result = dict(snapshot)
+        result['lag'] = max(time.time() - snapshot['timestamp'], 0.0)
+        return result
+
+    def get_top_processes(self, n, sort='cpu'):
+        """按需对最近一次采样的进程数据排序"""
+        with self.lock:
+            rows = self.process_rows
+        return rank_processes(rows, n, sort)
+
+    def _run(self):
+        # 按固定节拍采样，采样耗时不会累积成漂移
+        next_tick = time.monotonic() + self.interval
+        while not self._stop_event.wait(max(next_tick - time.monotonic(), 0)):
+            try:
+                self._store(self.collect())
+            except Exception as e:
+                print(f"系统信息采样失败: {str(e)}")
+            next_tick += self.interval
+            now = time.monotonic()
+            if next_tick < now:
+                # 采样过慢时跳过错过的节拍
+                next_tick = now + self.interval
+
+    def _store(self, sample):
+        snapshot, process_rows = sample
+        with self.lock:
+            self.snapshot = snapshot
+            self.process_rows = process_rows
+        for callback in self.listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"系统信息订阅回调失败: {str(e)}")
+
+    def collect(self):
+        """采集一次系统信息，返回 (快照, 全部进程数据)"""
+        started = time.monotonic()
+        timestamp = time.time()
+
+        # CPU信息（相对上次采样的使用率，不阻塞）
+        cpu_percent = psutil.cpu_percent(interval=None)
+        cpu_count = psutil.cpu_count()
+
+        # 内存信息
+        memory = psutil.virtual_memory()
+
+        # 磁盘信息 (所有分区)
+        disks = []
+        for partition in psutil.disk_partitions():
+            try:
+                usage = psutil.disk_usage(partition.mountpoint)
+                disks.append({
+                    'device': partition.device,
+                    'mountpoint': partition.mountpoint,
+                    'total': usage.total,
+                    'used': usage.used,
+                    'free': usage.free,
+                    'percent': (usage.used / usage.total) * 100 if usage.total > 0 else 0
+                })
+            except (PermissionError, OSError):
+                # 某些分区可能没有访问权限，跳过
+                continue
+
+        # 进程信息（复用进程缓存，CPU使用率为两次采样间的值）
+        process_rows = self.process_table.sample(memory.total)
+
+        snapshot = {
+            'cpu': {
+                'percent': cpu_percent,
+                'count': cpu_count
+            },
+            'memory': {
+                'total': memory.total,
+                'available': memory.available,
+                'used': memory.used,
+                'free': memory.free,
+                'percent': memory.percent
+            },
+            'disks': disks,
+            # 获取CPU和内存占用最高的5个进程
+            'top_processes': rank_processes(process_rows, 5, 'cpu'),
+            'top_memory_processes': rank_processes(process_rows, 5, 'memory'),
+            'timestamp': timestamp,
+            'sample_duration': time.monotonic() - started
+        }
+        return snapshot, process_rows
@@ -0,0 +1,277 @@
+"""
+Warm Pool Utility
+Keeps pre-started interpreters with modules preimported, so listed scripts skip interpreter startup and imports
+"""
+
+import os
+import sys
+import json
+import signal
+import socket
+import fnmatch
+import threading
+import subprocess
+
+# 等待工作进程就绪（完成预导入）的最长时间（秒）
+WORKER_READY_TIMEOUT = 120
+# 等待工作进程fork出子进程的最长时间（秒）
+WORKER_REPLY_TIMEOUT = 5
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warm_worker.py')
+# 需要fork和通过unix socket传递文件描述符
+WARM_SUPPORTED = hasattr(os, 'fork') and hasattr(socket, 'send_fds')
+
+DEFAULT_WARM_CONFIG = {
+    'enabled': False,
+    'pool_size': 2,
+    'preload': [],
+    'scripts': []
+}
+
+
+class WarmSpawnError(Exception):
+    """请求已发给工作进程但没有收到子进程pid，脚本可能已经开始运行，不能再按普通方式启动"""
+
+
+class WarmWorker:
+    """一个预先启动、已完成预导入的解释器进程"""
+
+    def __init__(self, preload):
+        self.sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, '-u', WORKER_SCRIPT, str(child_sock.fileno()), json.dumps(preload)],
+                pass_fds=[child_sock.fileno()],
+                stdin=subprocess.DEVNULL
+            )
+        finally:
+            child_sock.close()
+        self.reader = self.sock.makefile('rb')
+        self.generation = 0
+
+    def wait_ready(self):
+        """阻塞直到预导入完成，失败时返回False"""
+        self.sock.settimeout(WORKER_READY_TIMEOUT)
+        try:
+            ok = json.loads(self.reader.readline() or b'{}').get('ready', False)
+        except (OSError, ValueError):
+            ok = False
+        self.sock.settimeout(None)
+        return ok
+
+    def read_reply(self, timeout=None):
+        self.sock.settimeout(timeout)
+        try:
+            line = self.reader.readline()
+        finally:
+            self.sock.settimeout(None)
+        if not line:
+            raise OSError('warm worker exited')
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.close()
+            self.reader.close()
+        except OSError:
+            pass
+        # 关闭连接后工作进程自行退出
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class WarmProcess:
+    """工作进程fork出的脚本子进程，提供与subprocess.Popen一致的接口"""
+
+    def __init__(self, pool, worker, pid, stdout, stderr):
+        self.pool = pool
+        self.worker = worker
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            try:
+                self.returncode = self.worker.read_reply()['returncode']
+                self.pool._release(self.worker)
+            except (OSError, ValueError, KeyError):
+                # 工作进程异常退出，子进程的退出码无法得知
+                self.returncode = -1
+                self.pool._discard(self.worker)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class WarmPool:
+    """
+    预热解释器池：为monitor_config.json中warm_runner.scripts列出的脚本保留pool_size个工作进程，
+    每次运行由空闲的工作进程fork一个新的子进程用runpy执行脚本，没有空闲进程时返回None
+    """
+
+    def __init__(self):
+        self.settings = dict(DEFAULT_WARM_CONFIG)
+        self.idle = []
+        self.busy = set()
+        self.generation = 0   # 配置变化时加一，旧的工作进程不再复用
+        self.lock = threading.Lock()
+
+    def configure(self, settings):
+        """应用warm_runner配置，预导入列表或进程数变化时重建工作进程"""
+        settings = dict(DEFAULT_WARM_CONFIG, **(settings or {}))
+        settings['enabled'] = bool(settings['enabled']) and WARM_SUPPORTED
+        with self.lock:
+            rebuild = (settings['preload'] != self.settings['preload'] or
+                       settings['pool_size'] != self.settings['pool_size'] or
+                       settings['enabled'] != self.settings['enabled'])
+            self.settings = settings
+            retired = self.idle if rebuild else []
+            if rebuild:
+                self.idle = []
+                # 正在运行的工作进程在本次运行结束后关闭
+                self.generation += 1
+        for worker in retired:
+            worker.close()
+        if rebuild and settings['enabled']:
+            self._fill()
+
+    def matches(self, script_path):
+        """脚本是否配置为预热运行"""
+        settings = self.settings
+        if not settings['enabled']:
+            return False
+        path = os.path.realpath(script_path)
+        return any(fnmatch.fnmatch(path, os.path.realpath(pattern)) or fnmatch.fnmatch(path, pattern)
+                   for pattern in settings['scripts'])
+
+    def _fill(self):
+        """后台补足空闲工作进程"""
+        with self.lock:
+            missing = self.settings['pool_size'] - len(self.idle) - len(self.busy)
+            if not self.settings['enabled'] or missing <= 0:
+                return
+            preload = list(self.settings['preload'])
+            generation = self.generation
+            workers = [WarmWorker(preload) for _ in range(missing)]
+            for worker in workers:
+                worker.generation = generation
+                self.busy.add(worker)   # 就绪前不分配任务
+
+        def wait(worker):
+            ok = worker.wait_ready()
+            with self.lock:
+                self.busy.discard(worker)
+                keep = ok and worker.generation == self.generation
+                if keep:
+                    self.idle.append(worker)
+            if not keep:
+                if not ok:
+                    print(f"预热工作进程启动失败: pid {worker.process.pid}")
+                worker.close()
+
+        for worker in workers:
+            thread = threading.Thread(target=wait, args=(worker,), name='warm-worker-ready')
+            thread.daemon = True
+            thread.start()
+
+    def spawn(self, script_path, cpu_limit=None, memory_limit=None):
+        """
+        用空闲的工作进程运行脚本，返回WarmProcess；没有空闲进程或请求未能发出时返回None
+        请求发出后等待pid超时则抛出WarmSpawnError
+        """
+        with self.lock:
+            if not self.idle:
+                return None
+            worker = self.idle.pop()
+            self.busy.add(worker)
+
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        sent = False
+        try:
+            request = json.dumps({'script': script_path, 'cpu_limit': cpu_limit, 'memory_limit': memory_limit})
+            socket.send_fds(worker.sock, [request.encode('utf-8') + b'\n'], [stdout_w, stderr_w])
+            sent = True
+            pid = worker.read_reply(WORKER_REPLY_TIMEOUT)['pid']
+        except (OSError, ValueError, KeyError) as e:
+            for fd in (stdout_r, stderr_r):
+                os.close(fd)
+            if not sent:
+                print(f"预热运行失败，改为普通方式启动: {str(e)}")
+                self._discard(worker)
+                return None
+            # 子进程可能已经fork，再按普通方式启动会把脚本运行两次
+            self._abandon(worker)
+            raise WarmSpawnError(f'预热进程未响应: {str(e)}')
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+        return WarmProcess(self, worker, pid, os.fdopen(stdout_r, 'rb'), os.fdopen(stderr_r, 'rb'))
+
+    def _release(self, worker):
+        """运行结束，工作进程回到空闲列表（配置已变化时关闭）"""
+        with self.lock:
+            self.busy.discard(worker)
+            keep = self.settings['enabled'] and worker.generation == self.generation
+            if keep:
+                self.idle.append(worker)
+        if not keep:
+            worker.close()
+            self._fill()
+
+    def _abandon(self, worker):
+        """后台等待迟到的pid并结束该子进程，然后关闭工作进程"""
+        def reap():
+            try:
+                # 读取超时后makefile的读取对象不能再用，直接从socket读取
+                worker.sock.settimeout(WORKER_READY_TIMEOUT)
+                data = b''
+                while b'\n' not in data:
+                    chunk = worker.sock.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                pid = json.loads(data.split(b'\n', 1)[0])['pid']
+                os.kill(pid, signal.SIGKILL)
+            except (OSError, ValueError, KeyError):
+                pass
+            self._discard(worker)
+
+        thread = threading.Thread(target=reap, name='warm-worker-abandon')
+        thread.daemon = True
+        thread.start()
+
+    def _discard(self, worker):
+        with self.lock:
+            self.busy.discard(worker)
+        worker.close()
+        self._fill()
+
+    def status(self):
+        with self.lock:
+            return {
+                'supported': WARM_SUPPORTED,
+                'enabled': self.settings['enabled'],
+                'pool_size': self.settings['pool_size'],
+                'preload': self.settings['preload'],
+                'scripts': self.settings['scripts'],
+                'idle': len(self.idle),
+                'busy': len(self.busy)
+            }
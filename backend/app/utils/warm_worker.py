@@ -0,0 +1,116 @@
+"""
+Warm Worker
+Standalone interpreter that preimports modules, then runs each script in a fresh forked child
+
+Started by WarmPool as: python -u warm_worker.py <socket fd> <json list of modules>
+Protocol over the unix socket, one JSON object per line:
+  request  {"script": path, "cpu_limit": s, "memory_limit": bytes} with the stdout/stderr fds attached
+  replies  {"pid": child pid}, then {"returncode": code} when the child exits
+"""
+
+import os
+import sys
+import json
+import socket
+import importlib
+import traceback
+
+
+def preload(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"warm worker: failed to import {name}: {e}", file=sys.stderr)
+
+
+def run_child(sock, request, stdout_fd, stderr_fd):
+    """在fork出的子进程中运行脚本，不返回"""
+    try:
+        sock.close()
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+
+        import resource
+        if request.get('cpu_limit'):
+            limit = int(request['cpu_limit'])
+            resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+        if request.get('memory_limit'):
+            limit = int(request['memory_limit'])
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except BaseException:
+        # 准备阶段失败，不能回到工作进程的循环中
+        try:
+            traceback.print_exc()
+        finally:
+            os._exit(1)
+
+    import runpy
+    script = request['script']
+    sys.argv = [script]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    try:
+        runpy.run_path(script, run_name='__main__')
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    # 正常退出解释器：等待非守护线程、执行atexit并刷新输出，与直接运行脚本一致
+    raise SystemExit(code)
+
+
+def serve(sock):
+    reader = b''
+    received = None
+    while True:
+        while b'\n' not in reader:
+            data, fds, _, _ = socket.recv_fds(sock, 65536, 2)
+            if not data:
+                # 服务端已关闭连接
+                return
+            if len(fds) == 2:
+                received = fds
+            reader += data
+        line, reader = reader.split(b'\n', 1)
+        request = json.loads(line)
+        if received is None:
+            continue
+        stdout_fd, stderr_fd = received
+        received = None
+
+        pid = os.fork()
+        if pid == 0:
+            run_child(sock, request, stdout_fd, stderr_fd)
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        try:
+            sock.sendall(json.dumps({'pid': pid}).encode('utf-8') + b'\n')
+            _, status = os.waitpid(pid, 0)
+            sock.sendall(json.dumps({'returncode': os.waitstatus_to_exitcode(status)}).encode('utf-8') + b'\n')
+        except BrokenPipeError:
+            # 服务端已放弃本次运行并关闭连接
+            return
+
+
+def main():
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    preload(json.loads(sys.argv[2]) if len(sys.argv) > 2 else [])
+    sock.sendall(b'{"ready": true}\n')
+    serve(sock)
+
+
+if __name__ == '__main__':
+    main()